@@ -0,0 +1,404 @@
+#! /usr/bin/env python
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "update-tools.py")
+PUBLISHED = "2024-01-01T00:00:00Z"
+MODIFIED = email.utils.formatdate(1704067200, usegmt=True)
+
+
+class Stats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+            self.limited = 0
+
+    def add(self, sent: int = 0, request: bool = False, limited: bool = False):
+        with self._lock:
+            self.requests += int(request)
+            self.bytes += sent
+            self.limited += int(limited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "limited": self.limited,
+            }
+
+
+class RateLimit:
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._reset = time.time() + window
+        self._used = 0
+
+    def take(self, charge: bool = True) -> tuple:
+        with self._lock:
+            now = time.time()
+            if now >= self._reset:
+                self._reset = now + self.window
+                self._used = 0
+            if self.limit and charge:
+                self._used += 1
+            remaining = max(0, self.limit - self._used)
+            allowed = not self.limit or self._used <= self.limit
+            return allowed, remaining, int(self._reset)
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(("127.0.0.1", 0), BenchHandler)
+        self.latency = args.latency / 1000
+        self.bandwidth = args.bandwidth * 1024
+        self.rate_limit = RateLimit(args.rate_limit, args.rate_window)
+        self.releases = args.releases
+        self.stats = Stats()
+        self.asset = os.urandom(args.asset_size * 1024)
+        self.asset_digest = hashlib.sha256(self.asset).hexdigest()
+        self.etag = f'"{self.asset_digest[:16]}"'
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def release(self, repo: str, tag: str) -> dict:
+        name = repo.split("/")[-1]
+        return {
+            "tag_name": f"v{tag}",
+            "published_at": PUBLISHED,
+            "assets": [
+                {
+                    "name": asset,
+                    "browser_download_url": f"{self.url}/assets/{asset}",
+                    "digest": f"sha256:{self.asset_digest}",
+                }
+                for asset in (
+                    f"{name}-{tag}-linux-amd64.tar.gz",
+                    f"{name}-{tag}-darwin-arm64.tar.gz",
+                )
+            ],
+        }
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.handle_request(head=True)
+
+    def do_GET(self) -> None:
+        self.handle_request(head=False)
+
+    def handle_request(self, head: bool) -> None:
+        server = self.server
+        server.stats.add(request=True)
+        if server.latency:
+            time.sleep(server.latency)
+        path, _, query = self.path.partition("?")
+        if m := re.match(r"^/repos/([^/]+/[^/]+)/(releases|tags)(/latest)?$", path):
+            self.send_api(path, urllib.parse.parse_qs(query), *m.groups())
+        elif path.startswith("/assets/"):
+            self.send_asset(path.rsplit("/", 1)[-1], head)
+        else:
+            self.send_body(404, b"{}", {"Content-Type": "application/json"})
+
+    def send_api(
+        self, path: str, query: dict, repo: str, look_up: str, latest: str
+    ) -> None:
+        server = self.server
+        # Like GitHub, conditional requests answered with 304 are not charged
+        not_modified = self.headers.get("If-None-Match") == server.etag
+        allowed, remaining, reset = server.rate_limit.take(charge=not not_modified)
+        headers = {
+            "Content-Type": "application/json",
+            "ETag": server.etag,
+            "X-RateLimit-Limit": str(server.rate_limit.limit or 5000),
+            "X-RateLimit-Remaining": str(
+                remaining if server.rate_limit.limit else 4999
+            ),
+            "X-RateLimit-Reset": str(reset),
+        }
+        if not_modified:
+            return self.send_body(304, b"", headers)
+        if not allowed:
+            server.stats.add(limited=True)
+            headers["Retry-After"] = str(max(1, reset - int(time.time())))
+            body = b'{"message": "API rate limit exceeded"}'
+            return self.send_body(403, body, headers)
+
+        minors = range(server.releases - 1, -1, -1)
+        if latest:
+            data = server.release(repo, f"1.{minors[0]}.0")
+            return self.send_body(200, json.dumps(data).encode(), headers)
+
+        per_page = min(100, int(query.get("per_page", ["30"])[0]))
+        page = int(query.get("page", ["1"])[0])
+        minors = minors[(page - 1) * per_page : page * per_page]
+        if look_up == "tags":
+            data = [{"name": f"v1.{minor}.0"} for minor in minors]
+        else:
+            data = [server.release(repo, f"1.{minor}.0") for minor in minors]
+        if page * per_page < server.releases:
+            next_url = f"{server.url}{path}?per_page={per_page}&page={page + 1}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        self.send_body(200, json.dumps(data).encode(), headers)
+
+    def send_asset(self, name: str, head: bool) -> None:
+        server = self.server
+        body = server.asset
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{name}"',
+            "Last-Modified": MODIFIED,
+            "ETag": server.etag,
+            "Accept-Ranges": "bytes",
+        }
+        if self.headers.get("If-None-Match") == server.etag:
+            return self.send_body(304, b"", headers)
+
+        status = 200
+        rng = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if rng and (not if_range or if_range == server.etag):
+            if m := re.match(r"bytes=(\d+)-(\d*)$", rng):
+                start = int(m.group(1))
+                end = int(m.group(2)) if m.group(2) else len(body) - 1
+                if start >= len(body):
+                    headers["Content-Range"] = f"bytes */{len(body)}"
+                    return self.send_body(416, b"", headers)
+                end = min(end, len(body) - 1)
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+                body = body[start : end + 1]
+                status = 206
+        self.send_body(status, body, headers, head=head)
+
+    def send_body(self, status: int, body: bytes, headers: dict, head=False) -> None:
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if head or status == 304:
+            return
+        chunk = 64 * 1024
+        for offset in range(0, len(body), chunk):
+            block = body[offset : offset + chunk]
+            self.wfile.write(block)
+            self.server.stats.add(sent=len(block))
+            if self.server.bandwidth:
+                time.sleep(len(block) / self.server.bandwidth)
+
+
+def write_config(path: str, count: int, server: BenchServer, work_dir: str) -> None:
+    lines = [
+        "defaults:",
+        f"  pkg_dir: {work_dir}/packages",
+        f"  tmp_dir: {work_dir}/tmp",
+        f"  bin_dir: {work_dir}/bin",
+        "  ver:",
+        "    type: cmd",
+        "    name: echo 1.0.0",
+        "  git:",
+        f"    api_url: {server.url}",
+        "tools:",
+    ]
+    for index in range(count):
+        name = f"tool{index:04d}"
+        lines += [
+            f"  - name: {name}",
+            "    type: git",
+            f"    repo: bench/{name}",
+            "    incl: [linux]",
+            "    inst:",
+            f"      - cp {{{{ tool.pkg_dir }}}}/{{{{ tool.pkg_name }}}} "
+            f"{{{{ tool.bin_dir }}}}/{name}",
+        ]
+        if index % 3 == 1:
+            # Only the oldest release matches, so every page of the list is read
+            lines += ["    tag: '^v1.0.0$'", "    not_tags: ['rc']"]
+        elif index % 3 == 2:
+            lines += [
+                "    look_up: tags",
+                "    tag: '^v1'",
+                f"    url: {server.url}/assets/{name}-{{{{ tool.v_remote }}}}.tar.gz",
+            ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def run_scenario(args: argparse.Namespace, configs: list, work_dir: str, flags: list):
+    cmd = [sys.executable, args.script]
+    for config in configs:
+        cmd += ["-g", config]
+    cmd += [
+        "-s",
+        "--cache-dir",
+        os.path.join(work_dir, "cache"),
+        "--engine",
+        args.engine,
+    ] + flags
+    env = dict(os.environ)
+    env.pop(args.token_env, None)
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
+    )
+    output = b""
+    while chunk := proc.stdout.read(65536):
+        output += chunk
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.monotonic() - started
+    rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    errors = output.decode(errors="replace").count("    Tool '")
+    return elapsed, rss, errors, proc.returncode
+
+
+SCENARIOS = {
+    "check": ["-c"],
+    "download": ["-d"],
+    "download-warm": ["-d"],
+    "download-shared": ["-d", "-f"],
+    "update": ["-u"],
+    "list": ["-l"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark update-tools.py against a local GitHub stand-in"
+    )
+    parser.add_argument(
+        "--tools",
+        help="comma separated list of tool counts, defaults to 10,100,1000",
+        default="10,100,1000",
+    )
+    parser.add_argument(
+        "--scenarios",
+        help=f"comma separated list of scenarios ({', '.join(SCENARIOS)})",
+        default="check,download,download-warm,update",
+    )
+    parser.add_argument(
+        "--latency", help="added latency per request in ms", type=float, default=50
+    )
+    parser.add_argument(
+        "--bandwidth",
+        help="bandwidth per connection in KiB/s, 0 for unlimited",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="API requests allowed per window, 0 for unlimited",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--rate-window", help="rate limit window in seconds", type=float, default=60
+    )
+    parser.add_argument(
+        "--asset-size", help="size of each asset in KiB", type=int, default=256
+    )
+    parser.add_argument(
+        "--releases",
+        help="releases and tags per repository, listed 30 (or per_page) at a time",
+        type=int,
+        default=150,
+    )
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument("--script", help="script to benchmark", default=SCRIPT)
+    parser.add_argument("--token-env", default="GITHUB_TOKEN")
+    parser.add_argument(
+        "--json", action="store_true", help="print results as JSON lines"
+    )
+    args = parser.parse_args()
+
+    server = BenchServer(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    if not args.json:
+        print(
+            f"{'tools':>6} {'scenario':<16} {'wall s':>8} {'requests':>9} "
+            f"{'MiB':>9} {'limited':>8} {'RSS MiB':>8} {'errors':>7}"
+        )
+    try:
+        for count in [int(item) for item in args.tools.split(",")]:
+            work_dir = tempfile.mkdtemp(prefix="update-tools-bench-")
+            try:
+                for name in ("packages", "tmp", "bin"):
+                    os.makedirs(os.path.join(work_dir, name))
+                configs = [
+                    os.path.join(work_dir, name)
+                    for name in ("update-tools.yaml", "update-tools-ubuntu.yaml")
+                ]
+                for config in configs:
+                    write_config(config, count, server, work_dir)
+                for scenario in args.scenarios.split(","):
+                    server.stats.reset()
+                    # Both configurations list the same tools in the same pkg_dir
+                    shared = scenario.endswith("-shared")
+                    elapsed, rss, errors, returncode = run_scenario(
+                        args,
+                        configs if shared else configs[:1],
+                        work_dir,
+                        SCENARIOS[scenario],
+                    )
+                    result = {
+                        "tools": count,
+                        "scenario": scenario,
+                        "wall": round(elapsed, 3),
+                        **server.stats.snapshot(),
+                        "rss": rss,
+                        "errors": errors,
+                        "returncode": returncode,
+                    }
+                    if args.json:
+                        print(json.dumps(result), flush=True)
+                    else:
+                        print(
+                            f"{count:>6} {scenario:<16} {elapsed:>8.2f} "
+                            f"{result['requests']:>9} "
+                            f"{result['bytes'] / 2**20:>9.1f} "
+                            f"{result['limited']:>8} {rss / 2**20:>8.1f} "
+                            f"{errors:>7}",
+                            flush=True,
+                        )
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
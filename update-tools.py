@@ -1,22 +1,52 @@
 #! /usr/bin/env python
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from jinja2 import Template
+from functools import lru_cache
 
 import argparse
+import contextlib
+import copy
+import email.utils
 import glob
 import gzip
+import hashlib
+import importlib
+import io
 import json
+import lzma
+import mmap
 import os
+import queue
 import re
-import requests
 import shlex
 import shutil
+import signal
+import sqlite3
+import struct
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 import urllib.parse
-import yaml
+
+
+class LazyModule:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self.name), attr)
+
+
+asyncio = LazyModule("asyncio")
+jinja2 = LazyModule("jinja2")
+requests = LazyModule("requests")
+yaml = LazyModule("yaml")
 
 
 class Color:
@@ -26,7 +56,907 @@ class Color:
     RST = "\033[0m"
 
 
+class HttpCache:
+    STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link")
+
+    def __init__(self) -> None:
+        self.enabled = True
+        self.path = os.path.join(default_cache_dir(), "http")
+        self.max_age = 30 * 24 * 3600
+        self.max_size = 100 * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, enabled: bool, settings: dict) -> None:
+        self.path = os.path.join(path, "http")
+        self.enabled = enabled
+        self.max_age = float(settings.get("cache_max_age", 30)) * 24 * 3600
+        self.max_size = int(float(settings.get("cache_max_size", 100)) * 1024 * 1024)
+
+    def key(self, url: str, headers: dict) -> str:
+        identity = hashlib.sha256(headers.get("Authorization", "").encode()).hexdigest()
+        return hashlib.sha256(f"{url}\n{identity}".encode()).hexdigest()
+
+    def load(self, key: str) -> dict:
+        try:
+            with open(os.path.join(self.path, f"{key}.json"), "r") as f:
+                entry = json.load(f)
+            with open(os.path.join(self.path, f"{key}.body"), "rb") as f:
+                entry["body"] = f.read()
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def store(self, key: str, resp: requests.Response) -> None:
+        entry = {
+            "url": resp.url,
+            "status": resp.status_code,
+            "headers": {
+                name: resp.headers[name]
+                for name in self.STORED_HEADERS
+                if name in resp.headers
+            },
+            "stored_at": time.time(),
+        }
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            write_atomic(os.path.join(self.path, f"{key}.body"), resp.content)
+            write_atomic(
+                os.path.join(self.path, f"{key}.json"), json.dumps(entry).encode()
+            )
+        except OSError:
+            pass
+
+    def conditional(self, key: str, headers: dict) -> dict:
+        entry = self.load(key)
+        if entry:
+            if etag := entry["headers"].get("ETag"):
+                headers["If-None-Match"] = etag
+            if last_modified := entry["headers"].get("Last-Modified"):
+                headers["If-Modified-Since"] = last_modified
+        return entry
+
+    def settle(self, key: str, entry: dict, resp: requests.Response):
+        if resp.status_code == 304 and entry:
+            self.count(hit=True)
+            return self.response(key, entry, resp)
+
+        self.count(hit=False)
+        if resp.status_code == 200 and (
+            "ETag" in resp.headers or "Last-Modified" in resp.headers
+        ):
+            self.store(key, resp)
+        return resp
+
+    def response(self, key: str, entry: dict, revalidated: requests.Response):
+        for name in ("json", "body"):
+            try:
+                os.utime(os.path.join(self.path, f"{key}.{name}"))
+            except OSError:
+                pass
+        resp = requests.Response()
+        resp.status_code = entry["status"]
+        resp.url = revalidated.url
+        resp.headers = requests.structures.CaseInsensitiveDict(revalidated.headers)
+        resp.headers.update(entry["headers"])
+        resp._content = entry["body"]
+        resp.encoding = revalidated.encoding
+        return resp
+
+    def count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def evict(self) -> None:
+        if not self.enabled or not os.path.isdir(self.path):
+            return
+        entries = {}
+        for file in os.scandir(self.path):
+            key, _, ext = file.name.partition(".")
+            if ext not in ("json", "body"):
+                continue
+            stat = file.stat()
+            mtime, size = entries.get(key, (0, 0))
+            entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size)
+
+        now = time.time()
+        total = sum(size for _, size in entries.values())
+        for key, (mtime, size) in sorted(entries.items(), key=lambda i: i[1][0]):
+            if now - mtime <= self.max_age and total <= self.max_size:
+                continue
+            for ext in ("json", "body"):
+                try:
+                    os.remove(os.path.join(self.path, f"{key}.{ext}"))
+                except OSError:
+                    pass
+            total -= size
+
+
+class RateLimitError(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    def __init__(self) -> None:
+        self.low_water = 100
+        self.max_wait = 60.0
+        self.pools = {}
+        self.pool_size = 32
+        self.limits = {}
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def configure(self, settings: dict, pool_size: int, pools: dict) -> None:
+        self.low_water = max(1, int(settings.get("rate_limit_low", self.low_water)))
+        self.max_wait = float(settings.get("rate_limit_wait", self.max_wait))
+        self.pool_size = pool_size
+        self.pools = pools
+
+    def acquire(self, url: str) -> None:
+        host = urllib.parse.urlsplit(url).hostname
+        with self._cond:
+            while (delay := self._admit(host)) > 0:
+                self._cond.wait(delay)
+
+    async def acquire_async(self, url: str) -> None:
+        host = urllib.parse.urlsplit(url).hostname
+        while True:
+            with self._cond:
+                delay = self._admit(host)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def release(self, url: str, status: int = None, headers=None) -> bool:
+        host = urllib.parse.urlsplit(url).hostname
+        with self._cond:
+            state = self._hosts[host]
+            state["active"] -= 1
+            if headers is not None:
+                self._note(host, state, headers)
+            limited = self.limited(status, headers)
+            if limited:
+                now = time.time()
+                if retry_after := self._retry_after(headers):
+                    until = now + retry_after
+                elif headers.get("X-RateLimit-Remaining") == "0":
+                    until = state["reset"]
+                else:
+                    until = now + 2 ** state["strikes"]
+                state["blocked"] = max(state["blocked"], until)
+                state["strikes"] += 1
+                state["cap"] = max(1, state["cap"] // 2)
+            elif status is not None and status < 400:
+                state["strikes"] = 0
+                state["cap"] = min(state["pool"], state["cap"] + 1)
+            self._cond.notify_all()
+        return limited
+
+    @staticmethod
+    def limited(status: int, headers) -> bool:
+        if status == 429:
+            return True
+        return status == 403 and (
+            "Retry-After" in headers or headers.get("X-RateLimit-Remaining") == "0"
+        )
+
+    def _admit(self, host: str) -> float:
+        if host not in self._hosts:
+            pool = int(self.pools.get(host, self.pool_size))
+            self._hosts[host] = {
+                "pool": pool,
+                "cap": pool,
+                "active": 0,
+                "remaining": None,
+                "reset": 0,
+                "blocked": 0,
+                "strikes": 0,
+            }
+        state = self._hosts[host]
+        now = time.time()
+        if state["blocked"] > now:
+            delay = state["blocked"] - now
+        elif state["remaining"] is not None and state["remaining"] <= 0:
+            delay = state["reset"] - now
+        else:
+            delay = 0
+        if delay > self.max_wait:
+            reset = time.strftime("%H:%M:%S", time.localtime(now + delay))
+            raise RateLimitError(
+                f"API rate limit of {host} exceeded, it resets at {reset}"
+            )
+        if delay > 0:
+            return delay
+
+        cap = state["cap"]
+        if state["remaining"] is not None and state["remaining"] < self.low_water:
+            cap = min(cap, max(1, cap * state["remaining"] // self.low_water))
+        if state["active"] >= cap:
+            return 0.05
+        state["active"] += 1
+        if state["remaining"] is not None:
+            state["remaining"] -= 1
+        return 0
+
+    def _note(self, host: str, state: dict, headers) -> None:
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        limit = {
+            "limit": int(headers.get("X-RateLimit-Limit", 0)),
+            "remaining": int(headers["X-RateLimit-Remaining"]),
+            "reset": int(headers.get("X-RateLimit-Reset", 0)),
+        }
+        if limit["reset"] < state["reset"]:
+            return
+        # The server's count is authoritative: it does not charge 304 responses
+        self.limits[host] = limit
+        state["remaining"] = limit["remaining"] - state["active"]
+        state["reset"] = limit["reset"]
+
+    @staticmethod
+    def _retry_after(headers) -> float:
+        value = headers.get("Retry-After") if headers is not None else None
+        if not value:
+            return 0
+        if value.isdigit():
+            return float(value)
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+
+
+class HttpClient:
+    def __init__(self) -> None:
+        self.timeout = 30
+        self.retries = 3
+        self.backoff = 0.5
+        self.pool_size = 32
+        self.pools = {}
+        self.segments = 4
+        self.segment_size = 8 * 1024 * 1024
+        self.cache = HttpCache()
+        self.limiter = RateLimiter()
+        self.shared = 0
+        self._flights = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def configure(self, settings: dict) -> None:
+        self.timeout = settings.get("timeout", self.timeout)
+        if isinstance(self.timeout, list):
+            self.timeout = tuple(self.timeout)
+        self.retries = int(settings.get("retries", self.retries))
+        self.backoff = float(settings.get("backoff", self.backoff))
+        self.pool_size = int(settings.get("pool_size", self.pool_size))
+        self.pools = dict(settings.get("pools") or {})
+        self.segments = int(settings.get("segments", self.segments))
+        self.segment_size = int(
+            float(settings.get("segment_size", self.segment_size / 1024 / 1024))
+            * 1024
+            * 1024
+        )
+        self.limiter.configure(settings, self.pool_size, self.pools)
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = urllib.parse.urlsplit(url).hostname
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(url)
+            try:
+                with profiler.span(f"{method} {host}", "http", url=url):
+                    resp = self.session.request(method, url, **kwargs)
+            except BaseException:
+                self.limiter.release(url)
+                raise
+            limited = self.limiter.release(url, resp.status_code, resp.headers)
+            if not limited or attempt == self.retries:
+                return resp
+            resp.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def get_cached(self, url: str, headers: dict = None) -> requests.Response:
+        key = self.cache.key(url, headers or {})
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            resp = self._get_cached(url, headers)
+        except BaseException as e:
+            with self._lock:
+                del self._flights[key]
+            flight.set_exception(e)
+            raise
+        flight.set_result(resp)
+        return resp
+
+    def count_shared(self) -> None:
+        with self._lock:
+            self.shared += 1
+
+    def _get_cached(self, url: str, headers: dict = None) -> requests.Response:
+        if not self.cache.enabled:
+            return self.get(url, headers=headers)
+
+        headers = dict(headers or {})
+        key = self.cache.key(url, headers)
+        entry = self.cache.conditional(key, headers)
+        return self.cache.settle(key, entry, self.get(url, headers=headers))
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("HEAD", url, **kwargs)
+
+    def _new_session(self) -> requests.Session:
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10, pool_maxsize=self.pool_size, max_retries=retry
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        for host, size in self.pools.items():
+            host_adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=int(size), max_retries=retry
+            )
+            session.mount(f"https://{host}/", host_adapter)
+            session.mount(f"http://{host}/", host_adapter)
+        return session
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "update-tools")
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class Templates:
+    def __init__(self) -> None:
+        self._env = None
+        self._lock = threading.Lock()
+
+    @property
+    def env(self) -> jinja2.Environment:
+        with self._lock:
+            if self._env is None:
+                self._env = jinja2.Environment(
+                    loader=jinja2.FunctionLoader(lambda source: source),
+                    cache_size=-1,
+                )
+        return self._env
+
+
+templates = Templates()
+
+
+def template(source: str) -> jinja2.Template:
+    return templates.env.get_template(source)
+
+
+@lru_cache(maxsize=None)
+def regex(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, tool: Tool = None, **args):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if tool is not None:
+                tool.timings[name] = tool.timings.get(name, 0) + elapsed
+            if self.enabled:
+                if tool is not None:
+                    args["tool"] = tool.name
+                event = {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": round((started - self._origin) * 1e6),
+                    "dur": round(elapsed * 1e6),
+                    "pid": os.getpid(),
+                    "tid": self._thread(),
+                    "args": args,
+                }
+                with self._lock:
+                    event["tid"] = self.threads.setdefault(
+                        event["tid"], len(self.threads) + 1
+                    )
+                    self.events.append(event)
+
+    def _thread(self) -> str:
+        if "asyncio" in sys.modules:
+            try:
+                if task := sys.modules["asyncio"].current_task():
+                    return task.get_name()
+            except RuntimeError:
+                pass
+        return threading.current_thread().name
+
+    def summary(self) -> list:
+        totals = {}
+        for event in self.events:
+            key = (event["cat"], event["name"])
+            count, total, longest = totals.get(key, (0, 0, 0))
+            totals[key] = (count + 1, total + event["dur"], max(longest, event["dur"]))
+        return sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+
+    def write_trace(self, path: str) -> None:
+        names = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in self.threads.items()
+        ]
+        write_atomic(
+            path,
+            json.dumps(
+                {"traceEvents": names + self.events, "displayTimeUnit": "ms"}
+            ).encode(),
+        )
+
+
+profiler = Profiler()
+
+
+def run_command(args: list, **kwargs) -> subprocess.CompletedProcess:
+    kwargs.setdefault("capture_output", True)
+    kwargs.setdefault("encoding", "UTF-8")
+    with profiler.span(os.path.basename(args[0]), "subprocess", args=args):
+        return subprocess.run(args, **kwargs)
+
+
+class VersionMatcher:
+    def __init__(self, pattern: str, policy: str) -> None:
+        self.pattern = pattern
+        self.regex = regex(pattern) if pattern else None
+        self.policy = policy
+        self.lines = []
+
+    def feed(self, line: str) -> bool:
+        line = regex(r"\x1b\[\d+m").sub("", line)
+        if self.regex is None:
+            self.lines.append(line)
+            return False
+        if self.regex.search(line.rstrip("\n")):
+            self.lines = [line]
+            return self.policy == "first"
+        return False
+
+    @property
+    def output(self) -> str:
+        return "".join(self.lines)
+
+
+def probe_timeout_error(args: list, timeout: float) -> TimeoutError:
+    return TimeoutError(
+        f"Version command '{shlex.join(args)}' timed out after {timeout}s"
+    )
+
+
+def kill_probe(pid: int) -> None:
+    # Probes run in their own session, so wrapper scripts die with their children
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pid, signal.SIGKILL)
+
+
+def probe_command(args: list, matcher: VersionMatcher, timeout: float) -> str:
+    expired = threading.Event()
+    with profiler.span(os.path.basename(args[0]), "subprocess", args=args):
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="UTF-8",
+            errors="replace",
+            start_new_session=True,
+        )
+        timer = threading.Timer(timeout, lambda: (expired.set(), kill_probe(proc.pid)))
+        timer.start()
+        try:
+            for line in proc.stdout:
+                if matcher.feed(line):
+                    kill_probe(proc.pid)
+                    break
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+            proc.wait()
+    if expired.is_set():
+        raise probe_timeout_error(args, timeout)
+    return matcher.output
+
+
+def file_lines(path: str, reverse: bool = False):
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if reverse:
+                end = len(mm)
+                while end > 0:
+                    start = mm.rfind(b"\n", 0, end - 1) + 1
+                    yield mm[start:end].decode(errors="replace")
+                    end = start
+            else:
+                while line := mm.readline():
+                    yield line.decode(errors="replace")
+
+
+DIGESTS = ("md5", "sha1", "sha256")
+
+http_client = HttpClient()
+
+
+class Manifest:
+    FILE_NAME = ".update-tools-manifest.json"
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, pkg_dir: str) -> None:
+        self.path = os.path.join(pkg_dir, self.FILE_NAME)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as f:
+                self.records = json.load(f)
+        except (OSError, ValueError):
+            self.records = {}
+
+    @classmethod
+    def for_dir(cls, pkg_dir: str) -> "Manifest":
+        pkg_dir = os.path.realpath(pkg_dir)
+        with cls._instances_lock:
+            if pkg_dir not in cls._instances:
+                cls._instances[pkg_dir] = cls(pkg_dir)
+            return cls._instances[pkg_dir]
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            record = self.records.get(name)
+        try:
+            stat = os.stat(os.path.join(os.path.dirname(self.path), name))
+        except OSError:
+            return None
+        if record and (record["size"], record["mtime"]) == (
+            stat.st_size,
+            stat.st_mtime,
+        ):
+            return record
+        return None
+
+    def update(self, name: str, url: str, info: "RemoteInfo", **extra) -> None:
+        stat = os.stat(os.path.join(os.path.dirname(self.path), name))
+        with self._lock:
+            record = self.records.get(name, {})
+            record.update(
+                {
+                    "url": url,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "etag": info.etag if info else record.get("etag"),
+                    "last_modified": info.last_modified
+                    if info
+                    else record.get("last_modified"),
+                },
+                **extra,
+            )
+            self.records[name] = record
+            write_atomic(
+                self.path, json.dumps(self.records, indent=2, sort_keys=True).encode()
+            )
+
+
+class StateStore:
+    FIELDS = (
+        "pkg_url",
+        "pkg_name",
+        "pkg_digest",
+        "checksum_url",
+        "v_remote",
+        "v_remote_date",
+        "v_local",
+        "pkg_local",
+        "is_rpm",
+        "is_deb",
+    )
+    RETENTION = 30 * 24 * 3600
+
+    def __init__(self) -> None:
+        self.db = None
+        self.max_age = 0
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, max_age: int) -> None:
+        self.max_age = max_age
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.db = sqlite3.connect(
+                os.path.join(path, "state.sqlite3"), check_same_thread=False
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS checks "
+                "(key TEXT PRIMARY KEY, name TEXT, checked REAL, data TEXT)"
+            )
+            self.db.execute(
+                "DELETE FROM checks WHERE checked < ?",
+                (time.time() - self.RETENTION,),
+            )
+            self.db.commit()
+        except (OSError, sqlite3.Error):
+            self.db = None
+
+    def key(self, tool_def: dict, defaults: dict) -> str:
+        return hashlib.sha256(
+            json.dumps([tool_def, defaults], sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def fresh(self, tool_def: dict, defaults: dict) -> dict:
+        if not self.db or self.max_age <= 0:
+            return None
+        with self._lock:
+            row = self.db.execute(
+                "SELECT checked, data FROM checks WHERE key = ?",
+                (self.key(tool_def, defaults),),
+            ).fetchone()
+        if row and time.time() - row[0] <= self.max_age:
+            return json.loads(row[1])
+        return None
+
+    def restore(self, tool: "Tool") -> bool:
+        data = self.fresh(tool.tool_def, tool.defaults)
+        if data is None:
+            return False
+        for field, value in data.items():
+            setattr(tool, field, value)
+        tool.restored = True
+        return True
+
+    def save(self, tool: "Tool") -> None:
+        if not self.db or tool._errors or tool.pkg_name is None:
+            return
+        data = {field: getattr(tool, field, None) for field in self.FIELDS}
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?)",
+                (
+                    self.key(tool.tool_def, tool.defaults),
+                    tool.name,
+                    time.time(),
+                    json.dumps(data),
+                ),
+            )
+            self.db.commit()
+
+    def checked(self) -> dict:
+        if not self.db:
+            return {}
+        with self._lock:
+            return dict(self.db.execute("SELECT key, checked FROM checks"))
+
+    def forget(self, tool: "Tool") -> None:
+        if not self.db:
+            return
+        with self._lock:
+            self.db.execute(
+                "DELETE FROM checks WHERE key = ?",
+                (self.key(tool.tool_def, tool.defaults),),
+            )
+            self.db.commit()
+
+    def close(self) -> None:
+        if self.db:
+            self.db.close()
+            self.db = None
+
+
+state_store = StateStore()
+
+
+# Lookups are generators that yield the I/O they need as steps, so the threads
+# engine runs each step with blocking calls while the async engine awaits it
+class Fetch:
+    def __init__(
+        self, url: str, headers: dict = None, cached: bool = False, read: bool = True
+    ) -> None:
+        self.url = url
+        self.headers = headers
+        self.cached = cached
+        self.read = read
+
+    def run(self):
+        if self.cached:
+            return http_client.get_cached(self.url, headers=self.headers)
+        if not self.read:
+            with http_client.get(self.url, headers=self.headers, stream=True) as r:
+                return r
+        return http_client.get(self.url, headers=self.headers)
+
+    async def run_async(self, engine: "AsyncEngine"):
+        if self.cached:
+            return await engine.client.get_cached(self.url, headers=self.headers)
+        return await engine.client.request(
+            "GET", self.url, headers=self.headers, read=self.read
+        )
+
+
+class FetchRange:
+    def __init__(self, url: str, offset: int, size: int) -> None:
+        self.url = url
+        self.offset = offset
+        self.size = size
+        self.headers = {"Range": f"bytes={offset}-{offset + size - 1}"}
+
+    def run(self) -> bytes:
+        with http_client.get(self.url, headers=self.headers, stream=True) as r:
+            if self._supported(r):
+                return r.raw.read(self.size, decode_content=True)
+        return b""
+
+    async def run_async(self, engine: "AsyncEngine") -> bytes:
+        r = await engine.client.request(
+            "GET", self.url, headers=self.headers, limit=self.size
+        )
+        return r.content if self._supported(r) else b""
+
+    def _supported(self, r) -> bool:
+        if r.status_code == 416:
+            return False
+        if r.status_code != 206:
+            raise RangeNotSupported(f"No Range support for {self.url}")
+        return True
+
+
+class FetchFile:
+    def __init__(
+        self, url: str, dest_folder: str, file_name: str = None, sha256: str = None
+    ) -> None:
+        self.url = url
+        self.file_path = download_path(url, dest_folder, file_name)
+        self.sha256 = sha256
+
+    def run(self) -> "RemoteInfo":
+        return downloads.fetch(self.url, self.file_path, sha256=self.sha256)
+
+    async def run_async(self, engine: "AsyncEngine") -> "RemoteInfo":
+        return await downloads.fetch_async(
+            engine.client, self.url, self.file_path, sha256=self.sha256
+        )
+
+
+class Command:
+    def __init__(self, args: list) -> None:
+        self.args = args
+
+    def run(self) -> subprocess.CompletedProcess:
+        return run_command(self.args)
+
+    async def run_async(self, engine: "AsyncEngine") -> subprocess.CompletedProcess:
+        return await engine.command(self.args)
+
+
+class VersionProbe:
+    def __init__(self, args: list, matcher: "VersionMatcher", timeout: float) -> None:
+        self.args = args
+        self.matcher = matcher
+        self.timeout = timeout
+
+    def run(self) -> str:
+        return probe_command(self.args, self.matcher, self.timeout)
+
+    async def run_async(self, engine: "AsyncEngine") -> str:
+        return await engine.probe(self.args, self.matcher, self.timeout)
+
+
+class InstalledPackages:
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+
+    def run(self) -> dict:
+        return installed_packages.packages(self.kind)
+
+    async def run_async(self, engine: "AsyncEngine") -> dict:
+        return await engine.installed(self.kind)
+
+
+def run_steps(steps):
+    send, value = steps.send, None
+    while True:
+        try:
+            step = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = steps.send, step.run()
+        except Exception as e:
+            send, value = steps.throw, e
+
+
 class Tool:
+    pkg_url = None
+    pkg_name = None
+    pkg_local = None
+    pkg_digest = None
+    checksum_url = None
+    restored = False
+    updated = False
+    dl_bytes = 0
+
+    def get_data(self) -> None:
+        try:
+            run_steps(self.lookup())
+        except Exception as e:
+            self._errors.append(e)
+
+    def lookup(self):
+        with profiler.span("remote", "phase", self):
+            yield from self._get_data_remote()
+        yield from self._get_data_local()
+
     def check(self, verbose, skip=False) -> None:
         print_details = False
         if version_mismatch(self.v_remote, self.v_local):
@@ -47,52 +977,119 @@ class Tool:
             self._outputs.append(f"         local version: {self.v_local}")
             self._outputs.append(f"        local packages: {self.pkg_local}")
 
+    def resolved(self) -> bool:
+        if self.pkg_url and self.pkg_name:
+            return True
+        if not self._errors:
+            self._errors.append(LookupError("No package found for the tool"))
+        return False
+
     def download(self, verbose, force=False, skip=False) -> None:
-        dl = False
+        sha256 = self._remote_digest()
+        dl, record = self._check_local(verbose, force, sha256)
+        if dl is None:
+            with profiler.span("probe", "phase", self):
+                info = probe_remote(self.pkg_url, record)
+            dl = self._check_remote(verbose, info, record)
+
+        info = None
+        if dl:
+            self._download_started(verbose)
+            try:
+                with profiler.span("transfer", "phase", self):
+                    info = download_file(
+                        self.pkg_url, self.pkg_dir, self.pkg_name, sha256=sha256
+                    )
+            except ValueError as e:
+                self._errors.append(e)
+        self._download_finished(verbose, dl, info, sha256, skip)
+
+    def _check_local(self, verbose, force: bool, sha256: str) -> tuple:
+        pkg_path = os.path.join(self.pkg_dir, self.pkg_name)
+        manifest = Manifest.for_dir(self.pkg_dir)
+        self._freshness = {}
         if force:
-            dl = True
             if verbose >= 2:
                 self._outputs.append("        Download forced")
-        elif not os.path.exists(os.path.join(self.pkg_dir, self.pkg_name)):
-            dl = True
+            return True, None
+        elif not os.path.exists(pkg_path):
             if verbose >= 2:
                 self._outputs.append("        Local file does not exist")
+            return True, None
+        elif sha256 and sha256 == self._local_digest(manifest, pkg_path):
+            if verbose >= 2:
+                self._outputs.append("        Local file matches remote checksum")
+            manifest.update(self.pkg_name, self.pkg_url, None, sha256=sha256)
+            return False, None
+        elif sha256:
+            if verbose >= 2:
+                self._outputs.append("        Local file has different checksum")
+            return True, None
+
+        record = manifest.get(self.pkg_name)
+        if record and record["url"] != self.pkg_url:
+            record = None
+        return None, record
+
+    def _check_remote(self, verbose, info: "RemoteInfo", record: dict) -> bool:
+        dl = False
+        pkg_path = os.path.join(self.pkg_dir, self.pkg_name)
+        local_size = os.path.getsize(pkg_path)
+        local_dt = datetime.fromtimestamp(int(os.path.getmtime(pkg_path)))
+        if info.not_modified:
+            info = RemoteInfo(info.status, record_headers(record))
+            info.size = remote_size = record["size"]
         else:
-            r = requests.get(self.pkg_url, stream=True)
-            remote_size = int(r.headers.get("Content-Length"))
-            local_size = os.path.getsize(os.path.join(self.pkg_dir, self.pkg_name))
-            if remote_size != local_size:
-                dl = True
-                if verbose >= 2:
-                    self._outputs.append(
-                        "        Local file exists but has different size"
-                    )
-                    self._outputs.append(f"        Local file size: {local_size}")
-                    self._outputs.append(f"       Remote file size: {remote_size}")
-            else:
-                remote_dt = datetime.strptime(
-                    r.headers.get("Last-Modified", r.headers.get("Date")),
-                    "%a, %d %b %Y %H:%M:%S %Z",
-                )
-                local_dt = datetime.fromtimestamp(
-                    int(os.path.getmtime(os.path.join(self.pkg_dir, self.pkg_name)))
-                )
-                if remote_dt > local_dt:
-                    dl = True
-                    if verbose >= 2:
-                        self._outputs.append("        Local file exists but is older")
-                        self._outputs.append(f"        Local file date: {local_dt}")
-                        self._outputs.append(f"       Remote file date: {remote_dt}")
+            remote_size = info.size
+        remote_dt = info.modified and datetime.fromtimestamp(info.modified)
+        if info.not_modified:
+            if verbose >= 2:
+                self._outputs.append("        Remote file not modified")
+        elif remote_size != local_size:
+            dl = True
+            if verbose >= 2:
+                self._outputs.append("        Local file exists but has different size")
+                self._outputs.append(f"        Local file size: {local_size}")
+                self._outputs.append(f"       Remote file size: {remote_size}")
+        elif remote_dt and remote_dt > local_dt:
+            dl = True
+            if verbose >= 2:
+                self._outputs.append("        Local file exists but is older")
+                self._outputs.append(f"        Local file date: {local_dt}")
+                self._outputs.append(f"       Remote file date: {remote_dt}")
+        else:
+            Manifest.for_dir(self.pkg_dir).update(self.pkg_name, self.pkg_url, info)
 
-        if dl:
-            self._outputs.append(f"{Color.YLW}    {self.name}{Color.RST}")
+        self._freshness = {
+            "Local file size": local_size,
+            "Remote file size": remote_size,
+            "Local file date": str(local_dt),
+            "Remote file date": str(remote_dt),
+        }
+        return dl
+
+    def _download_started(self, verbose) -> None:
+        self._outputs.append(f"{Color.YLW}    {self.name}{Color.RST}")
+        if verbose >= 2:
+            self._outputs.append(f"        Downloading package {self.pkg_name}")
+
+    def _download_finished(
+        self, verbose, dl: bool, info: "RemoteInfo", sha256: str, skip: bool
+    ) -> None:
+        if dl and info:
+            Manifest.for_dir(self.pkg_dir).update(
+                self.pkg_name, self.pkg_url, info, **info.digests
+            )
+            self.dl_bytes = info.transferred
+            if verbose >= 1:
+                self._outputs.append(f"        Downloaded {self.pkg_name}")
             if verbose >= 2:
-                self._outputs.append(f"        Downloading package {self.pkg_name}")
-            if download_file(self.pkg_url, self.pkg_dir, self.pkg_name):
-                if verbose >= 1:
-                    self._outputs.append(f"        Downloaded {self.pkg_name}")
-                self.dl_ok = True
-        elif not skip:
+                verified = "verified" if sha256 else "not verified"
+                self._outputs.append(
+                    f"        SHA256 ({verified}): {info.digests['sha256']}"
+                )
+            self.dl_ok = True
+        elif not dl and not skip:
             self._outputs.append(f"    {self.name}")
             if verbose >= 2:
                 self._outputs.append(
@@ -101,12 +1098,44 @@ class Tool:
                 self._outputs.append(
                     f"        Existing local packages: {self.pkg_local}"
                 )
-                self._outputs.append(f"        Local file size: {local_size}")
-                self._outputs.append(f"        Remote file size: {remote_size}")
-                self._outputs.append(f"        Local file date: {local_dt}")
-                self._outputs.append(f"        Remote file date: {remote_dt}")
+                for key, value in self._freshness.items():
+                    self._outputs.append(f"        {key}: {value}")
+
+    def _remote_digest(self, checksums: str = None) -> str:
+        if self.pkg_digest and self.pkg_digest.startswith("sha256:"):
+            return self.pkg_digest.split(":", 1)[1].lower()
+        if self.checksum_url and checksums is None:
+            r = http_client.get_cached(self.checksum_url)
+            checksums = r.content.decode(errors="replace") if r.ok else ""
+        if checksums:
+            return parse_checksums(checksums, self.pkg_name)
+        return None
+
+    def _local_digest(self, manifest: "Manifest", pkg_path: str) -> str:
+        if record := manifest.get(self.pkg_name):
+            if record.get("sha256"):
+                return record["sha256"]
+        return file_digests(pkg_path)["sha256"]
 
     def update(self, verbose, force=False, skip=False) -> None:
+        if self._update_needed(verbose, force, skip):
+            steps = self._install_steps()
+            resources = self._install_resources(verbose, steps)
+            install_locks.acquire(resources)
+            try:
+                for count, cmd in enumerate(steps, start=1):
+                    self._step_started(verbose, count, cmd)
+                    started = time.monotonic()
+                    with profiler.span(f"step {count}", "phase", self, cmd=cmd):
+                        returncode = run_command(shlex.split(cmd)).returncode
+                    self._step_finished(
+                        verbose, count, returncode, time.monotonic() - started
+                    )
+            finally:
+                install_locks.release(resources)
+            self.updated = True
+
+    def _update_needed(self, verbose, force=False, skip=False) -> bool:
         update = False
         if force:
             self._outputs.append(f"{Color.YLW}    {self.name}{Color.RST}")
@@ -129,109 +1158,332 @@ class Tool:
             self._outputs.append(f"        Not updating: {self.pkg_name}")
             self._outputs.append(f"        RPM package: {self.is_rpm}")
             self._outputs.append(f"        DEB package: {self.is_deb}")
+        return update
 
-        if update:
-            for count, step in enumerate(self.inst, start=1):
-                tm = Template(os.path.expandvars(step))
-                cmd = tm.render(tool=self)
-                if verbose >= 2:
-                    self._outputs.append(
-                        f"           Step {count}/{len(self.inst)}: {cmd}"
-                    )
-                if not subprocess.run(
-                    shlex.split(cmd), capture_output=True, encoding="UTF-8"
-                ).returncode:
-                    if verbose >= 1:
-                        self._outputs.append(
-                            f"           Step {count}/{len(self.inst)}: completed."
-                        )
-                else:
-                    raise RuntimeError(
-                        f"           Step {count}/{len(self.inst)}: failed."
-                    )
+    def _install_steps(self) -> list:
+        return [
+            template(os.path.expandvars(step)).render(tool=self) for step in self.inst
+        ]
 
-    def _get_data_local(self) -> None:
-        try:
-            files = list(os.scandir(os.path.realpath(os.path.expandvars(self.pkg_dir))))
-            self.pkg_local = [
-                file.name for file in files if self.name.lower() in file.name.lower()
-            ]
+    def _step_started(self, verbose, count: int, cmd: str) -> None:
+        if verbose >= 2:
+            self._outputs.append(f"           Step {count}/{len(self.inst)}: {cmd}")
+
+    def _install_resources(self, verbose, steps: list) -> set:
+        locks = self.tool_def.get("locks", [])
+        resources = {locks} if isinstance(locks, str) else set(locks)
+        pkg_dir = os.path.realpath(self.pkg_dir)
+        for step in steps:
+            words = shlex.split(step)
+            commands = set(words[:1])
+            if "sudo" in words:
+                resources.add("sudo")
+                commands.update(words[words.index("sudo") + 1 :][:1])
+            if any(os.path.basename(word) in PKG_MANAGERS for word in words):
+                resources.add("package-manager")
+            for path in INSTALL_PATH_RE.findall(step):
+                if path in commands or path.startswith(("/dev/", "/proc/")):
+                    continue
+                if re.search(r"[*?[]", path):
+                    path = os.path.dirname(re.split(r"[*?[]", path, maxsplit=1)[0])
+                path = os.path.normpath(path)
+                if os.path.commonpath([path, pkg_dir]) != pkg_dir:
+                    resources.add(path)
+        if verbose >= 2:
+            self._outputs.append(f"        Install locks: {sorted(resources)}")
+        return resources
+
+    def _step_finished(
+        self, verbose, count: int, returncode: int, elapsed: float
+    ) -> None:
+        if not returncode:
+            if verbose >= 1:
+                self._outputs.append(
+                    f"           Step {count}/{len(self.inst)}: "
+                    f"completed in {elapsed:.2f}s."
+                )
+        else:
+            raise RuntimeError(
+                f"           Step {count}/{len(self.inst)}: "
+                f"failed after {elapsed:.2f}s."
+            )
 
-            if self.pkg_local and self.is_rpm:
-                rpm_name = subprocess.run(
-                    shlex.split(
-                        f"rpm --qf '%{{NAME}}' -qp {os.path.join(self.pkg_dir, self.pkg_local[0])}"
-                    ),
-                    capture_output=True,
-                    encoding="UTF-8",
-                ).stdout.strip("\n")
-                ver = subprocess.run(
-                    shlex.split(f"rpm --qf '%{{VERSION}}' -q {rpm_name}"),
-                    capture_output=True,
-                    encoding="UTF-8",
-                ).stdout.strip("\n")
-                if "not installed" not in ver:
-                    self.v_local = ver
-            elif self.pkg_local and self.is_deb:
-                deb_info = subprocess.run(
-                    shlex.split(
-                        f"dpkg -I {os.path.join(self.pkg_dir, self.pkg_local[0])}"
-                    ),
-                    capture_output=True,
-                    encoding="UTF-8",
-                ).stdout.strip("\n")
-                ver_lines = [line for line in deb_info.split("\n") if "Version" in line]
-                if ver_lines:
-                    ver = ver_lines[0].split(":")[1].strip()
-                if "not installed" not in ver:
-                    self.v_local = ver
-            elif self.ver.get("type") == "cmd":
-                ver_cmd = self.ver.get("name")
-                tm = Template(ver_cmd)
-                cmd = tm.render(tool=self)
-                if shutil.which(shlex.split(cmd)[0]):
-                    ver = re.sub(
-                        r"\x1b\[\d+m",
-                        "",
-                        subprocess.run(
-                            shlex.split(cmd), capture_output=True, encoding="UTF-8"
-                        ).stdout,
-                    ).strip("\n")
-                    if rx := self.ver.get("regex"):
-                        if m := re.search(rx, ver):
-                            if m.groups():
-                                self.v_local = m.groups()[0]
-                            elif m.group():
-                                self.v_local = m.group()
-                    else:
-                        self.v_local = ver.strip("v")
-            elif self.ver.get("type") == "file":
-                ver_file = self.ver.get("name")
-                tm = Template(ver_file)
-                file_name = tm.render(tool=self)
-                if fp := glob.glob(os.path.expandvars(file_name)):
-                    file_path = max(fp, key=lambda f: os.stat(f).st_ctime)
+    def _get_data_local(self):
+        try:
+            self._scan_pkg_dir()
+            with profiler.span("local", "phase", self):
+                if args := self._version_cmd():
+                    paths = self._probe_paths(args)
+                    matcher = self._version_matcher("first")
+                    identity, output = probe_cache.lookup(args, paths, matcher)
+                    if output is None:
+                        output = yield VersionProbe(args, matcher, self.ver["timeout"])
+                        probe_cache.store(args, paths, matcher, identity, output)
+                    self._apply_version(output)
                 else:
-                    raise OSError(f"File '{file_name}' not found")
-
-                if rx := self.ver.get("regex"):
-                    if m := re.search(rx, file_path):
-                        if m.groups():
-                            self.v_local = m.groups()[0]
-                        elif m.group():
-                            self.v_local = m.group()
-                    else:
-                        with open(file_path, "r") as f:
-                            file_lines = f.readlines()
-                        for line in file_lines:
-                            m = re.search(rx, line.strip("\n"))
-                            if m and m.groups():
-                                self.v_local = m.groups()[0]
-                            elif m and m.group():
-                                self.v_local = m.group()
+                    yield from self._get_version_local()
         except Exception as e:
             self._errors.append(e)
 
+    def _scan_pkg_dir(self) -> None:
+        files = list(os.scandir(os.path.realpath(os.path.expandvars(self.pkg_dir))))
+        self.pkg_local = [
+            file.name
+            for file in files
+            if self.name.lower() in file.name.lower() and not file.name.startswith(".")
+        ]
+
+    def _version_cmd(self) -> list:
+        if self.pkg_local and (self.is_rpm or self.is_deb):
+            return None
+        if self.ver.get("type") == "cmd":
+            ver_cmd = self.ver.get("name")
+            tm = template(ver_cmd)
+            cmd = tm.render(tool=self)
+            if shutil.which(shlex.split(cmd)[0]):
+                return shlex.split(cmd)
+        return None
+
+    def _probe_paths(self, args: list) -> list:
+        paths = [os.path.realpath(shutil.which(args[0]))]
+        paths += [arg for arg in args[1:] if os.path.isabs(arg)]
+        for watch in self.ver.get("watch") or []:
+            pattern = os.path.expandvars(template(watch).render(tool=self))
+            paths += sorted(glob.glob(pattern)) or [pattern]
+        return paths
+
+    def _version_matcher(self, policy: str) -> VersionMatcher:
+        return VersionMatcher(self.ver.get("regex"), self.ver.get("match") or policy)
+
+    def _apply_version(self, output: str) -> None:
+        ver = re.sub(r"\x1b\[\d+m", "", output).strip("\n")
+        if rx := self.ver.get("regex"):
+            if m := regex(rx).search(ver):
+                if m.groups():
+                    self.v_local = m.groups()[0]
+                elif m.group():
+                    self.v_local = m.group()
+        else:
+            self.v_local = ver.strip("v")
+
+    def _get_version_local(self):
+        if self.pkg_local and self.is_rpm:
+            rpm_name = read_rpm_header(
+                RangeReader(os.path.join(self.pkg_dir, self.pkg_local[0]))
+            )["NAME"]
+            self.v_local = (yield InstalledPackages("rpm")).get(rpm_name)
+        elif self.pkg_local and self.is_deb:
+            deb_name = read_deb_control(
+                RangeReader(os.path.join(self.pkg_dir, self.pkg_local[0]))
+            )["Package"]
+            self.v_local = (yield InstalledPackages("deb")).get(deb_name)
+        elif self.ver.get("type") == "file":
+            ver_file = self.ver.get("name")
+            tm = template(ver_file)
+            file_name = tm.render(tool=self)
+            if fp := glob.glob(os.path.expandvars(file_name)):
+                file_path = max(fp, key=lambda f: os.stat(f).st_ctime)
+            else:
+                raise OSError(f"File '{file_name}' not found")
+
+            if rx := self.ver.get("regex"):
+                if m := regex(rx).search(file_path):
+                    if m.groups():
+                        self.v_local = m.groups()[0]
+                    elif m.group():
+                        self.v_local = m.group()
+                else:
+                    # Reading backwards, the first hit is the file's last match
+                    reverse = (self.ver.get("match") or "last") == "last"
+                    matcher = VersionMatcher(rx, "first")
+                    for line in file_lines(file_path, reverse):
+                        if matcher.feed(line):
+                            break
+                    if matcher.output:
+                        self._apply_version(matcher.output)
+
+
+class PackageIndex:
+    COMMANDS = {
+        "rpm": ["rpm", "-qa", "--qf", "%{NAME}\t%{VERSION}\n"],
+        "deb": [
+            "dpkg-query",
+            "-W",
+            "-f",
+            "${Package}\t${Version}\t${db:Status-Abbrev}\n",
+        ],
+    }
+
+    def __init__(self) -> None:
+        self._packages = {}
+        self._lock = threading.Lock()
+
+    def packages(self, kind: str) -> dict:
+        with self._lock:
+            if kind not in self._packages:
+                args = self.command(kind)
+                out = run_command(args).stdout if args else ""
+                self._packages[kind] = self.parse(kind, out)
+            return self._packages[kind]
+
+    def command(self, kind: str) -> list:
+        args = self.COMMANDS[kind]
+        return args if shutil.which(args[0]) else None
+
+    def parse(self, kind: str, out: str) -> dict:
+        return getattr(self, f"_parse_{kind}")(out)
+
+    @staticmethod
+    def _parse_rpm(out: str) -> dict:
+        return dict(line.split("\t", 1) for line in out.splitlines() if "\t" in line)
+
+    @staticmethod
+    def _parse_deb(out: str) -> dict:
+        packages = {}
+        for line in out.splitlines():
+            name, version, status = (line.split("\t") + ["", ""])[:3]
+            if status.startswith("ii"):
+                packages[name] = version
+        return packages
+
+
+installed_packages = PackageIndex()
+
+
+class ProbeCache:
+    MAX_AGE = 30 * 24 * 3600
+
+    def __init__(self) -> None:
+        self.path = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, enabled: bool) -> None:
+        self.path = os.path.join(path, "probes.json") if enabled else None
+        self.entries = {}
+        if self.path:
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def identity(self, paths: list) -> list:
+        result = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            result.append([path, st.st_ino, st.st_size, st.st_mtime_ns])
+        return result
+
+    def key(self, args: list, paths: list, matcher: VersionMatcher) -> str:
+        # The cached output is already filtered by the matcher's regex and policy
+        return json.dumps([args, paths, matcher.pattern, matcher.policy])
+
+    def lookup(self, args: list, paths: list, matcher: VersionMatcher) -> tuple:
+        key = self.key(args, paths, matcher)
+        identity = self.identity(paths) if self.path else None
+        with self._lock:
+            entry = self.entries.get(key)
+            if identity is not None and entry and entry["identity"] == identity:
+                self.hits += 1
+                entry["used"] = time.time()
+                self._dirty = True
+                return identity, entry["output"]
+            self.misses += 1
+        return identity, None
+
+    def store(
+        self,
+        args: list,
+        paths: list,
+        matcher: VersionMatcher,
+        identity: list,
+        output: str,
+    ) -> None:
+        if identity is None:
+            return
+        with self._lock:
+            self.entries[self.key(args, paths, matcher)] = {
+                "identity": identity,
+                "output": output,
+                "used": time.time(),
+            }
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        entries = {
+            key: entry
+            for key, entry in self.entries.items()
+            if now - entry.get("used", 0) <= self.MAX_AGE
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(entries).encode())
+        except OSError:
+            pass
+
+
+probe_cache = ProbeCache()
+
+
+PKG_MANAGERS = (
+    "apt",
+    "apt-get",
+    "dnf",
+    "dpkg",
+    "flatpak",
+    "rpm",
+    "snap",
+    "yum",
+    "zypper",
+)
+INSTALL_PATH_RE = re.compile(r"(?:^|[\s=:'\"])(/[^\s'\";|&<>]*)")
+
+
+class InstallLocks:
+    def __init__(self) -> None:
+        self._held = []
+        self._cond = threading.Condition()
+
+    def acquire(self, resources: set) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._free(resources))
+            self._held.extend(resources)
+
+    def try_acquire(self, resources: set) -> bool:
+        with self._cond:
+            if not self._free(resources):
+                return False
+            self._held.extend(resources)
+            return True
+
+    def _free(self, resources: set) -> bool:
+        return not any(self._conflict(a, b) for a in resources for b in self._held)
+
+    def release(self, resources: set) -> None:
+        with self._cond:
+            for resource in resources:
+                self._held.remove(resource)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _conflict(a: str, b: str) -> bool:
+        if a.startswith("/") and b.startswith("/"):
+            return os.path.commonpath([a, b]) in (a, b)
+        return a == b
+
+
+install_locks = InstallLocks()
+
 
 class ToolGit(Tool):
     def __init__(self, tool_def: dict, defaults: dict) -> None:
@@ -267,77 +1519,108 @@ class ToolGit(Tool):
         self.opt_dir = os.path.expandvars(tool_def.get("opt_dir", defaults["opt_dir"]))
         self.tmp_dir = os.path.expandvars(tool_def.get("tmp_dir", defaults["tmp_dir"]))
         self.pkg_dir = os.path.expandvars(tool_def.get("plg_dir", defaults["pkg_dir"]))
+        self.api_url = tool_def.get("api_url", defaults["git"]["api_url"]).rstrip("/")
         self.__env_token_name = defaults["git"]["token_env"]
 
         self._errors = []
         self._outputs = []
+        self.timings = {}
 
-    def get_data(self) -> None:
-        try:
-            self._get_data_remote()
-            self._get_data_local()
-        except Exception as e:
-            self._errors.append(e)
-
-    def _get_data_remote(self) -> None:
-        if self.__env_token_name:
-            gh_token = os.environ.get(self.__env_token_name)
-        if gh_token:
-            headers = {"Authorization": f"token {gh_token}"}
-        else:
-            headers = {}
-
+    def remote_url(self) -> str:
         if self.tag == "latest":
-            url = f"https://api.github.com/repos/{self.repo}/{self.look_up}/{self.tag}"
+            return f"{self.api_url}/repos/{self.repo}/{self.look_up}/{self.tag}"
         else:
-            url = f"https://api.github.com/repos/{self.repo}/{self.look_up}"
+            return f"{self.api_url}/repos/{self.repo}/{self.look_up}?per_page=100"
+
+    def _get_data_remote(self):
+        url = self.remote_url()
+        resp = self._prefetched(url)
+        if resp is None:
+            headers = self.api_headers()
+            if self.tag == "latest":
+                r = yield Fetch(url, headers=headers, cached=True)
+                resp = github_json(r, url)
+            else:
+                resp = yield from self._select_pages(url, headers)
+        self._apply_remote(resp)
 
-        req = requests.get(url, headers=headers)
-        resp = json.loads(req.content.decode())
+        if self.custom:
+            custom_tool = ToolCustom.from_tool(self)
+            yield from custom_tool._get_data_remote()
+            self.pkg_url = custom_tool.pkg_url
+            self.pkg_name = custom_tool.pkg_name
 
-        if self.look_up == "releases":
-            if self.tag != "latest":
-                for not_tag in self.not_tags:
-                    resp = list(filter(lambda i: not_tag not in i["tag_name"], resp))
-                resp = list(filter(lambda i: self.tag in i["tag_name"], resp))
-                self.v_remote = resp[0]["tag_name"].strip("v")
-                self.v_remote_date = resp[0]["published_at"]
-                if not self.custom:
-                    assets = resp[0]["assets"]
-            else:
-                self.v_remote = resp["tag_name"].strip("v")
-                self.v_remote_date = resp["published_at"]
-                if not self.custom:
-                    assets = resp["assets"]
-        elif self.look_up in ["tags", "branches"]:
-            if "^" not in self.tag and "$" not in self.tag:
-                git_tag = list(filter(lambda i: self.tag in i["name"], resp))
-            if self.tag.startswith("^"):
-                git_tag = list(
-                    filter(lambda i: i["name"].startswith(self.tag.strip("^")), resp)
-                )
-            if self.tag.endswith("$"):
-                git_tag = list(
-                    filter(lambda i: i["name"].endwith(self.tag.strip("$")), resp)
-                )
-            self.v_remote = f"{git_tag[0]['name']}"
+        if self.pkg_name.endswith("rpm"):
+            self.is_rpm = True
 
-        else:
+        if self.pkg_name.endswith("deb"):
+            self.is_deb = True
+
+    def api_headers(self) -> dict:
+        return github_headers(self.__env_token_name)
+
+    def _prefetched(self, url: str):
+        if self.look_up not in ["releases", "tags", "branches"]:
             raise ValueError(f"Not recognized look up: {self.look_up}")
+        resp = github_resolver.get(url)
+        if isinstance(resp, list):
+            return self._select(resp)
+        return resp
+
+    def _select_pages(self, url: str, headers: dict):
+        while url:
+            r = yield Fetch(url, headers=headers, cached=True)
+            if (item := self._select(github_json(r, url))) is not None:
+                return item
+            url = next_page(r.headers)
+        return None
+
+    def _select(self, items) -> dict:
+        key = "tag_name" if self.look_up == "releases" else "name"
+        for item in items:
+            if self._tag_matches(item[key]):
+                return item
+        return None
+
+    def _tag_matches(self, name: str) -> bool:
+        if any(not_tag in name for not_tag in self.not_tags):
+            return False
+        if self.tag.startswith("^") and self.tag.endswith("$"):
+            return name == self.tag[1:-1]
+        elif self.tag.startswith("^"):
+            return name.startswith(self.tag[1:])
+        elif self.tag.endswith("$"):
+            return name.endswith(self.tag[:-1])
+        return self.tag in name
+
+    def _apply_remote(self, resp: dict) -> None:
+        if resp is None:
+            raise LookupError(f"No {self.look_up} matching '{self.tag}' found")
+
+        assets = []
+        if self.look_up == "releases":
+            self.v_remote = resp["tag_name"].strip("v")
+            self.v_remote_date = resp["published_at"]
+            if not self.custom:
+                assets = resp["assets"]
+        else:
+            self.v_remote = f"{resp['name']}"
 
         if not self.custom:
+            checksums = [item for item in assets if is_checksum_file(item["name"])]
             for incl in self.incl:
                 assets = list(filter(lambda i: incl in i["name"], assets))
             for excl in self.excl:
                 assets = list(filter(lambda i: excl not in i["name"], assets))
+            assets = [item for item in assets if not is_checksum_file(item["name"])]
 
             if self.url:
-                tm = Template(self.url)
+                tm = template(self.url)
                 self.pkg_url = tm.render(tool=self)
                 if not self.package:
                     self.pkg_name = self.pkg_url.split("/")[-1]
                 else:
-                    tm = Template(self.package)
+                    tm = template(self.package)
                     self.pkg_name = tm.render(tool=self)
             else:
                 if len(assets) > 1:
@@ -347,25 +1630,16 @@ class ToolGit(Tool):
                 else:
                     self.pkg_url = assets[0]["browser_download_url"]
                     self.pkg_name = assets[0]["name"]
+                    self.pkg_digest = assets[0].get("digest")
+                    self.checksum_url = checksum_asset_url(self.pkg_name, checksums)
         else:
-            self.url = (
-                f"https://api.github.com/repos/{self.repo}/{self.look_up}/{self.tag}"
-            )
-            custom_tool = ToolCustom.from_tool(self)
-            custom_tool.get_data()
-            self.pkg_url = custom_tool.pkg_url
-            self.pkg_name = custom_tool.pkg_name
-
-        if self.pkg_name.endswith("rpm"):
-            self.is_rpm = True
-
-        if self.pkg_name.endswith("deb"):
-            self.is_deb = True
+            self.url = f"{self.api_url}/repos/{self.repo}/{self.look_up}/{self.tag}"
 
 
 class ToolDirect(Tool):
     def __init__(self, tool_def: dict, defaults: dict) -> None:
         self.tool_def = tool_def
+        self.defaults = defaults
         self.name = tool_def["name"]
         self.url = self.pkg_url = tool_def["url"]
         self.package = tool_def.get("package")
@@ -388,55 +1662,59 @@ class ToolDirect(Tool):
 
         self._errors = []
         self._outputs = []
+        self.timings = {}
 
-    def get_data(self) -> None:
-        try:
-            self._get_data_remote()
-            self._get_data_local()
-        except Exception as e:
-            self._errors.append(e)
-
-    def _get_data_remote(self) -> None:
+    def _get_data_remote(self):
         if self.url:
-            tm = Template(self.url)
+            tm = template(self.url)
             self.pkg_url = tm.render(tool=self)
 
         if not self.package:
             self.pkg_name = self.pkg_url.split("/")[-1]
         else:
-            tm = Template(self.package)
+            tm = template(self.package)
             self.pkg_name = tm.render(tool=self)
 
         if self.pkg_name.endswith("rpm"):
             self.is_rpm = True
-            self.v_remote = subprocess.run(
-                shlex.split(f"rpm --qf '%{{VERSION}}' -qp {self.pkg_url}"),
-                capture_output=True,
-                encoding="UTF-8",
-            ).stdout.strip("\n")
+            try:
+                header = yield from RangeReader(self.pkg_url).parse(read_rpm_header)
+                self.v_remote = header["VERSION"]
+            except RangeNotSupported:
+                r = yield Command(
+                    shlex.split(f"rpm --qf '%{{VERSION}}' -qp {self.pkg_url}")
+                )
+                self.v_remote = r.stdout.strip("\n")
         elif self.pkg_name.endswith("deb"):
             self.is_deb = True
-            if download_file(self.pkg_url, self.tmp_dir, self.pkg_name):
-                deb_info = subprocess.run(
-                    shlex.split(f"dpkg -I {os.path.join(self.tmp_dir, self.pkg_name)}"),
-                    capture_output=True,
-                    encoding="UTF-8",
-                ).stdout.strip("\n")
-                os.remove(os.path.join(self.tmp_dir, self.pkg_name))
-                ver_lines = [line for line in deb_info.split("\n") if "Version" in line]
-                if ver_lines:
-                    ver = ver_lines[0].split(":")[1].strip()
-                    self.v_remote = ver
+            try:
+                control = yield from RangeReader(self.pkg_url).parse(read_deb_control)
+                self.v_remote = control.get("Version")
+            except (RangeNotSupported, ValueError, tarfile.TarError):
+                yield from self._get_deb_version_downloaded()
         elif ver_remote := self.tool_def.get("ver_remote"):
-            r = requests.get(url=ver_remote["url"])
-            self.v_remote = re.search(ver_remote["regex"], r.content.decode()).groups()[
-                0
-            ]
+            r = yield Fetch(ver_remote["url"])
+            self.v_remote = (
+                regex(ver_remote["regex"]).search(r.content.decode()).groups()[0]
+            )
+
+    def _get_deb_version_downloaded(self):
+        if (yield FetchFile(self.pkg_url, self.tmp_dir, self.pkg_name)):
+            r = yield Command(
+                shlex.split(f"dpkg -I {os.path.join(self.tmp_dir, self.pkg_name)}")
+            )
+            deb_info = r.stdout.strip("\n")
+            os.remove(os.path.join(self.tmp_dir, self.pkg_name))
+            ver_lines = [line for line in deb_info.split("\n") if "Version" in line]
+            if ver_lines:
+                ver = ver_lines[0].split(":", 1)[1].strip()
+                self.v_remote = ver
 
 
 class ToolCustom(Tool):
     def __init__(self, tool_def: dict, defaults: dict) -> None:
         self.tool_def = tool_def
+        self.defaults = defaults
         self.name = tool_def["name"]
         self.url = self.pkg_url = tool_def["url"]
         self.package = tool_def.get("package")
@@ -464,20 +1742,18 @@ class ToolCustom(Tool):
         self.pkg_dir = os.path.expandvars(
             tool_def.get("pkg_dir", defaults.get("pkg_dir"))
         )
+        self.__env_token_name = defaults["git"]["token_env"]
 
         self._errors = []
         self._outputs = []
+        self.timings = {}
 
-    def get_data(self) -> None:
-        try:
-            getattr(self, f"_get_data_{self.name}")()
-            if self.pkg_name.endswith("rpm"):
-                self.is_rpm = True
-            if self.pkg_name.endswith("deb"):
-                self.is_deb = True
-            self._get_data_local()
-        except Exception as e:
-            self._errors.append(e)
+    def _get_data_remote(self):
+        yield from getattr(self, f"_get_data_{self.name}")()
+        if self.pkg_name.endswith("rpm"):
+            self.is_rpm = True
+        if self.pkg_name.endswith("deb"):
+            self.is_deb = True
 
     @classmethod
     def from_tool(cls, tool: Tool) -> None:
@@ -498,11 +1774,12 @@ class ToolCustom(Tool):
         }
         return cls(custom_dict, tool.defaults)
 
-    def _get_data_azuredatastudio(self) -> None:
-        r = requests.get(self.url)
-        if m := re.search(
-            r"\[linux-rpm\]: (.*)\r", json.loads(r.content.decode())["body"]
-        ):
+    def api_headers(self) -> dict:
+        return github_headers(self.__env_token_name)
+
+    def _get_data_azuredatastudio(self):
+        r = yield Fetch(self.url, headers=self.api_headers(), cached=True)
+        if m := re.search(r"\[linux-rpm\]: (.*)\r", github_json(r, self.url)["body"]):
             self.pkg_url = m.groups()[0]
         else:
             self.pkg_url = None
@@ -510,11 +1787,11 @@ class ToolCustom(Tool):
         if not self.package:
             self.pkg_name = self.pkg_url.split("/")[-1]
         else:
-            tm = Template(self.package)
+            tm = template(self.package)
             self.pkg_name = tm.render(tool=self)
 
-    def _get_data_usbimager(self) -> None:
-        r = requests.get(self.url)
+    def _get_data_usbimager(self):
+        r = yield Fetch(self.url)
         if m := re.search(
             r"Linux PC.*?\[GTK\+\]\((.*?" + self.package + r")\)", r.content.decode()
         ):
@@ -527,23 +1804,24 @@ class ToolCustom(Tool):
             self.pkg_url = None
             self.pkg_name = None
 
-    def _get_data_postman(self) -> None:
+    def _get_data_postman(self):
         self.pkg_url = self.url
 
-        r = requests.get(self.pkg_url, stream=True)
-        if m := re.search(r".*filename=(.*)", r.headers["Content-Disposition"]):
+        r = yield Fetch(self.pkg_url, read=False)
+        disposition = r.headers["Content-Disposition"]
+        if m := re.search(r".*filename=(.*)", disposition):
             self.pkg_name = m.groups()[0]
         else:
             self.pkg_name = None
 
-        r = requests.get("https://www.postman.com/mkapi/release.json")
+        r = yield Fetch("https://www.postman.com/mkapi/release.json")
         if r.ok:
             self.v_remote = json.loads(r.content)["notes"][0]["version"]
         else:
             self.v_remote = None
 
-    def _get_data_icaclient(self) -> None:
-        r = requests.get(self.url)
+    def _get_data_icaclient(self):
+        r = yield Fetch(self.url)
         if m := re.search(
             r'rel="(.*ICAClient-rhel.*x86_64.rpm.*?)"', r.content.decode()
         ):
@@ -561,8 +1839,8 @@ class ToolCustom(Tool):
         else:
             self.v_remote = None
 
-    def _get_data_7z(self) -> None:
-        r = requests.get(self.url)
+    def _get_data_7z(self):
+        r = yield Fetch(self.url)
         if m := re.search(r"Download 7-Zip ([\d\.]+)", r.content.decode()):
             self.v_remote = m.groups()[0]
         else:
@@ -579,6 +1857,147 @@ class ToolCustom(Tool):
             self.pkg_name = None
 
 
+class GitHubResolver:
+    CHUNK_SIZE = 25
+    RELEASE_FIELDS = """
+        tagName
+        publishedAt
+        releaseAssets(first: 100) { nodes { name downloadUrl size digest } }
+    """
+
+    def __init__(self) -> None:
+        self.results = {}
+
+    def get(self, url: str):
+        return self.results.get(url)
+
+    def prefetch(self, tools: list, token_env: str) -> None:
+        headers = github_headers(token_env)
+        if not headers:
+            return
+
+        lookups = {}
+        for tool in tools:
+            if tool.custom or tool.look_up not in ["releases", "tags", "branches"]:
+                continue
+            lookups.setdefault(tool.remote_url(), tool)
+
+        chunks = {}
+        for url, tool in lookups.items():
+            graphql_url = re.sub(r"(/v3)?$", "", tool.api_url, count=1) + "/graphql"
+            chunks.setdefault(graphql_url, [[]])
+            if len(chunks[graphql_url][-1]) >= self.CHUNK_SIZE:
+                chunks[graphql_url].append([])
+            chunks[graphql_url][-1].append((url, tool))
+
+        with ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(self._query, graphql_url, chunk, headers)
+                for graphql_url, url_chunks in chunks.items()
+                for chunk in url_chunks
+            ]
+            for future in as_completed(futures):
+                self.results.update(future.result())
+
+    def _query(self, graphql_url: str, chunk: list, headers: dict) -> dict:
+        fields = []
+        for count, (_, tool) in enumerate(chunk):
+            owner, name = tool.repo.split("/", 1)
+            fields.append(
+                f"t{count}: repository(owner: {json.dumps(owner)}, "
+                f"name: {json.dumps(name)}) {{ {self._fields(tool)} }}"
+            )
+        query = "query {\n" + "\n".join(fields) + "\n}"
+        try:
+            r = http_client.post(graphql_url, json={"query": query}, headers=headers)
+            if not r.ok:
+                return {}
+            data = r.json().get("data") or {}
+        except (requests.RequestException, ValueError, RateLimitError):
+            return {}
+
+        results = {}
+        for count, (url, tool) in enumerate(chunk):
+            if repo := data.get(f"t{count}"):
+                if (resp := self._to_rest(tool, repo)) is not None:
+                    results[url] = resp
+        return results
+
+    def _fields(self, tool: Tool) -> str:
+        if tool.look_up == "releases" and tool.tag == "latest":
+            return f"latestRelease {{ {self.RELEASE_FIELDS} }}"
+        elif tool.look_up == "releases":
+            return (
+                "releases(first: 30, orderBy: {field: CREATED_AT, direction: DESC}) "
+                f"{{ nodes {{ {self.RELEASE_FIELDS} }} }}"
+            )
+        elif tool.look_up == "tags":
+            # Same order as the REST API's tags, so a tag pattern picks the same one
+            return (
+                'refs(refPrefix: "refs/tags/", first: 100, '
+                "orderBy: {field: ALPHABETICAL, direction: DESC}) "
+                "{ nodes { name } }"
+            )
+        else:
+            return 'refs(refPrefix: "refs/heads/", first: 100) { nodes { name } }'
+
+    def _to_rest(self, tool: Tool, repo: dict):
+        def release(node: dict) -> dict:
+            return {
+                "tag_name": node["tagName"],
+                "published_at": node["publishedAt"],
+                "assets": [
+                    {
+                        "name": asset["name"],
+                        "browser_download_url": asset["downloadUrl"],
+                        "size": asset["size"],
+                        "digest": asset.get("digest"),
+                    }
+                    for asset in node["releaseAssets"]["nodes"]
+                ],
+            }
+
+        if tool.look_up == "releases" and tool.tag == "latest":
+            if repo.get("latestRelease"):
+                return release(repo["latestRelease"])
+            return None
+        elif tool.look_up == "releases":
+            return [release(node) for node in repo["releases"]["nodes"]]
+        else:
+            return [{"name": node["name"]} for node in repo["refs"]["nodes"]]
+
+
+def github_headers(token_env: str) -> dict:
+    if token_env and (gh_token := os.environ.get(token_env)):
+        return {"Authorization": f"token {gh_token}"}
+    else:
+        return {}
+
+
+def next_page(headers) -> str:
+    if m := regex(r'<([^>]+)>;\s*rel="next"').search(headers.get("Link", "")):
+        return m.group(1)
+    return None
+
+
+def github_json(resp: requests.Response, url: str):
+    if resp.ok:
+        return json.loads(resp.content.decode())
+    try:
+        message = json.loads(resp.content.decode())["message"]
+    except (ValueError, KeyError, TypeError):
+        message = resp.content.decode(errors="replace").strip()[:200]
+    error = f"{url} returned HTTP {resp.status_code}"
+    if message:
+        error += f": {message}"
+    if RateLimiter.limited(resp.status_code, resp.headers):
+        raise RateLimitError(error)
+    raise RuntimeError(error)
+
+
+github_resolver = GitHubResolver()
+
+
 def version_mismatch(v_remote: str, v_local: str) -> bool:
     if v_local is None or v_remote is None:
         return False
@@ -589,23 +2008,666 @@ def version_mismatch(v_remote: str, v_local: str) -> bool:
             return True
 
 
-def download_file(url: str, dest_folder: str, file_name=None) -> bool:
+class RemoteInfo:
+    def __init__(self, status: int, headers: dict) -> None:
+        self.status = status
+        self.digests = {}
+        self.not_modified = status == 304
+        self.size = None
+        if m := re.match(r"bytes \d+-\d+/(\d+)", headers.get("Content-Range", "")):
+            self.size = int(m.groups()[0])
+        elif status == 200 and headers.get("Content-Length"):
+            self.size = int(headers["Content-Length"])
+        self.last_modified = headers.get("Last-Modified")
+        self.modified = None
+        if value := headers.get("Last-Modified", headers.get("Date")):
+            self.modified = email.utils.parsedate_to_datetime(value).timestamp()
+        self.etag = headers.get("ETag")
+        self.accept_ranges = headers.get("Accept-Ranges") == "bytes" or status == 206
+        self.transferred = 0
+
+
+def record_headers(record: dict) -> dict:
+    headers = {}
+    if record.get("etag"):
+        headers["ETag"] = record["etag"]
+    if record.get("last_modified"):
+        headers["Last-Modified"] = record["last_modified"]
+    return headers
+
+
+def probe_headers(record: dict = None) -> dict:
+    headers = {}
+    if record:
+        headers["If-Modified-Since"] = email.utils.formatdate(
+            record["mtime"], usegmt=True
+        )
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+    return headers
+
+
+def probe_remote(url: str, record: dict = None) -> RemoteInfo:
+    headers = probe_headers(record)
+    r = http_client.head(url, headers=headers)
+    info = RemoteInfo(r.status_code, r.headers)
+    if info.not_modified or (r.ok and info.size is not None):
+        return info
+
+    headers["Range"] = "bytes=0-0"
+    with http_client.get(url, headers=headers, stream=True) as r:
+        return RemoteInfo(r.status_code, r.headers)
+
+
+class DownloadChanged(Exception):
+    pass
+
+
+class Download:
+    CHUNK_SIZE = 1024 * 1024
+    SAVE_EVERY = 8
+
+    def __init__(self, url: str, file_path: str) -> None:
+        self.url = self.source_url = url
+        self.file_path = file_path
+        self.part_path = os.path.join(
+            os.path.dirname(file_path), f".{os.path.basename(file_path)}.part"
+        )
+        self.state_path = f"{self.part_path}.json"
+        self.headers = {}
+        self.size = None
+        self.resumable = False
+        self.segments = []
+        self.hashes = {name: hashlib.new(name) for name in DIGESTS}
+        self.transferred = 0
+        self._hashed = 0
+        self._lock = threading.Lock()
+        self._hash_lock = threading.Lock()
+
+    def run(self, sha256: str = None) -> RemoteInfo:
+        try:
+            info = self._run()
+        except DownloadChanged:
+            self._discard()
+            info = self._run()
+        return self._finish(info, sha256)
+
+    def _finish(self, info: RemoteInfo, sha256: str) -> RemoteInfo:
+        if info is None:
+            return None
+
+        info.digests = {name: h.hexdigest() for name, h in self.hashes.items()}
+        info.transferred = self.transferred
+        if sha256 and info.digests["sha256"] != sha256.lower():
+            self._discard()
+            raise ValueError(
+                f"Checksum mismatch for {os.path.basename(self.file_path)}: "
+                f"expected {sha256}, got {info.digests['sha256']}"
+            )
+        os.replace(self.part_path, self.file_path)
+        self._remove_state()
+        return info
+
+    def _run(self) -> RemoteInfo:
+        resp = None
+        if not self._load_state():
+            resp = http_client.get(self.url, stream=True)
+            if not resp.ok:
+                print(f"Download failed: status code {resp.status_code}\n{resp.text}")
+                resp.close()
+                return None
+            self._plan(resp)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.segments)) as executor:
+                futures = [
+                    executor.submit(self._fetch, index, resp if index == 0 else None)
+                    for index in range(len(self.segments))
+                ]
+                for future in as_completed(futures):
+                    future.result()
+        finally:
+            self._save_state()
+
+        return self._complete()
+
+    def _complete(self) -> RemoteInfo:
+        if self.size is not None and os.path.getsize(self.part_path) != self.size:
+            raise OSError(f"Incomplete download of {self.url}")
+        with open(self.part_path, "rb") as f:
+            self._hash(f)
+        return RemoteInfo(200, self.headers)
+
+    def _plan(self, resp: requests.Response) -> None:
+        info = RemoteInfo(resp.status_code, resp.headers)
+        self.source_url = resp.url
+        self.headers = {
+            name: resp.headers[name]
+            for name in ("Content-Length", "ETag", "Last-Modified")
+            if name in resp.headers
+        }
+        self.size = info.size
+        self.resumable = info.accept_ranges and info.size is not None
+        if self.size is None:
+            self.segments = [[0, None, 0]]
+        else:
+            count = 1
+            if self.resumable:
+                count = min(http_client.segments, self.size // http_client.segment_size)
+            step = -(-self.size // max(count, 1)) or 1
+            self.segments = [
+                [start, min(start + step, self.size) - 1, start]
+                for start in range(0, self.size, step)
+            ] or [[0, -1, 0]]
+
+        with open(self.part_path, "wb") as f:
+            if self.size:
+                f.truncate(self.size)
+        self._save_state()
+
+    def _fetch(self, index: int, resp: requests.Response = None) -> None:
+        attempts = 0
+        while True:
+            start, end, offset = self.segments[index]
+            if end is not None and offset > end:
+                if resp is not None:
+                    resp.close()
+                return
+            try:
+                if resp is None:
+                    resp = self._request_range(offset, end)
+                with resp, open(self.part_path, "r+b") as f:
+                    self._write(index, resp, f)
+                resp = None
+                start, end, offset = self.segments[index]
+                if end is None or offset > end:
+                    return
+                raise OSError(f"Connection closed early while downloading {self.url}")
+            except (requests.RequestException, OSError):
+                resp = None
+                attempts += 1
+                if not self.resumable or attempts > http_client.retries:
+                    raise
+
+    def _range_headers(self, offset: int, end: int) -> dict:
+        headers = {"Range": f"bytes={offset}-{'' if end is None else end}"}
+        validator = self.headers.get("ETag", "")
+        if not validator or validator.startswith("W/"):
+            validator = self.headers.get("Last-Modified")
+        if validator:
+            headers["If-Range"] = validator
+        return headers
+
+    def _request_range(self, offset: int, end: int) -> requests.Response:
+        headers = self._range_headers(offset, end)
+        resp = http_client.get(self.source_url, headers=headers, stream=True)
+        if resp.status_code != 206:
+            resp.close()
+            if self.source_url != self.url:
+                self.source_url = self.url
+                return self._request_range(offset, end)
+            raise DownloadChanged()
+        return resp
+
+    def _write(self, index: int, resp: requests.Response, f) -> None:
+        count = 0
+        _, end, offset = self.segments[index]
+        for chunk in resp.iter_content(chunk_size=self.CHUNK_SIZE):
+            if end is not None:
+                chunk = chunk[: end + 1 - offset]
+            offset = self._store(f, index, chunk, offset)
+            count += 1
+            if count % self.SAVE_EVERY == 0:
+                self._save_state()
+            if end is not None and offset > end:
+                break
+
+    def _store(self, f, index: int, chunk: bytes, offset: int) -> int:
+        os.pwrite(f.fileno(), chunk, offset)
+        with self._lock:
+            self.segments[index][2] = offset + len(chunk)
+            self.transferred += len(chunk)
+        self._hash(f, chunk, offset)
+        return offset + len(chunk)
+
+    def _hash(self, f, chunk: bytes = b"", offset: int = None) -> None:
+        with self._hash_lock:
+            if chunk and offset == self._hashed:
+                for h in self.hashes.values():
+                    h.update(chunk)
+                self._hashed += len(chunk)
+
+            with self._lock:
+                written = self._hashed
+                for _, end, done in self.segments:
+                    written = done
+                    if end is None or done <= end:
+                        break
+            while self._hashed < written:
+                block = os.pread(
+                    f.fileno(),
+                    min(self.CHUNK_SIZE, written - self._hashed),
+                    self._hashed,
+                )
+                if not block:
+                    break
+                for h in self.hashes.values():
+                    h.update(block)
+                self._hashed += len(block)
+
+    def _load_state(self) -> bool:
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("url") != self.url or not os.path.exists(self.part_path):
+            self._discard()
+            return False
+        self.headers = state["headers"]
+        self.size = state["size"]
+        self.segments = state["segments"]
+        self.resumable = True
+        return True
+
+    def _save_state(self) -> None:
+        if not self.resumable:
+            return
+        with self._lock:
+            state = {
+                "url": self.url,
+                "headers": self.headers,
+                "size": self.size,
+                "segments": self.segments,
+            }
+            try:
+                write_atomic(self.state_path, json.dumps(state).encode())
+            except OSError:
+                pass
+
+    def _remove_state(self) -> None:
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    def _discard(self) -> None:
+        self._remove_state()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+        self.source_url = self.url
+        self.headers = {}
+        self.size = None
+        self.resumable = False
+        self.segments = []
+        self.hashes = {name: hashlib.new(name) for name in DIGESTS}
+        self._hashed = 0
+
+
+class AsyncDownload(Download):
+    # Transfers run on the event loop, only disk writes and hashing are handed
+    # to the loop's executor the way aiofiles does
+    def __init__(self, client: "AsyncHttpClient", url: str, file_path: str) -> None:
+        super().__init__(url, file_path)
+        self.client = client
+
+    async def run(self, sha256: str = None) -> RemoteInfo:
+        try:
+            info = await self._run()
+        except DownloadChanged:
+            self._discard()
+            info = await self._run()
+        return self._finish(info, sha256)
+
+    async def _run(self) -> RemoteInfo:
+        loop = asyncio.get_running_loop()
+        async with contextlib.AsyncExitStack() as stack:
+            resp = None
+            if not self._load_state():
+                resp = await stack.enter_async_context(self.client.stream(self.url))
+                if resp.status >= 400:
+                    text = (await resp.read()).decode(errors="replace")
+                    print(f"Download failed: status code {resp.status}\n{text}")
+                    return None
+                self._plan(AsyncResponse(resp.status, resp.headers, b"", str(resp.url)))
+
+            try:
+                # Like the executor of Download, every segment is waited for
+                results = await asyncio.gather(
+                    *[
+                        self._fetch(index, resp if index == 0 else None)
+                        for index in range(len(self.segments))
+                    ],
+                    return_exceptions=True,
+                )
+            finally:
+                await loop.run_in_executor(None, self._save_state)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return await loop.run_in_executor(None, self._complete)
+
+    async def _fetch(self, index: int, resp=None) -> None:
+        attempts = 0
+        while True:
+            start, end, offset = self.segments[index]
+            if end is not None and offset > end:
+                return
+            try:
+                with open(self.part_path, "r+b") as f:
+                    if resp is None:
+                        async with self._request_range(offset, end) as resp:
+                            await self._write(index, resp, f)
+                    else:
+                        await self._write(index, resp, f)
+                resp = None
+                start, end, offset = self.segments[index]
+                if end is None or offset > end:
+                    return
+                raise OSError(f"Connection closed early while downloading {self.url}")
+            except (self.client.errors, OSError):
+                resp = None
+                attempts += 1
+                if not self.resumable or attempts > http_client.retries:
+                    raise
+
+    @contextlib.asynccontextmanager
+    async def _request_range(self, offset: int, end: int):
+        while True:
+            headers = self._range_headers(offset, end)
+            async with self.client.stream(self.source_url, headers=headers) as resp:
+                if resp.status == 206:
+                    yield resp
+                    return
+            if self.source_url == self.url:
+                raise DownloadChanged()
+            self.source_url = self.url
+
+    async def _write(self, index: int, resp, f) -> None:
+        loop = asyncio.get_running_loop()
+        count = 0
+        _, end, offset = self.segments[index]
+        async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+            if end is not None:
+                chunk = chunk[: end + 1 - offset]
+            offset = await loop.run_in_executor(
+                None, self._store, f, index, chunk, offset
+            )
+            count += 1
+            if count % self.SAVE_EVERY == 0:
+                await loop.run_in_executor(None, self._save_state)
+            if end is not None and offset > end:
+                break
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class RangeNeeded(Exception):
+    def __init__(self, offset: int, size: int) -> None:
+        super().__init__(f"Range {offset}+{size} not fetched yet")
+        self.offset = offset
+        self.size = size
+
+
+class RangeReader:
+    PREFETCH = 64 * 1024
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.is_url = "://" in source
+        self._blocks = {}
+
+    def read(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        for start, (length, data) in self._blocks.items():
+            if start <= offset and end <= start + length:
+                return data[offset - start : end - start]
+
+        size = max(size, self.PREFETCH)
+        if self.is_url:
+            raise RangeNeeded(offset, size)
+        with open(self.source, "rb") as f:
+            f.seek(offset)
+            self._blocks = {offset: (size, f.read(size))}
+        return self.read(offset, end - offset)
+
+    def parse(self, parser):
+        # Remote ranges are fetched as steps, parsing again once each one arrives
+        while True:
+            try:
+                return parser(self)
+            except RangeNeeded as e:
+                data = yield FetchRange(self.source, e.offset, e.size)
+                self._blocks[e.offset] = (e.size, data)
+
+
+RPM_TAGS = {1000: "NAME", 1001: "VERSION", 1002: "RELEASE", 1022: "ARCH"}
+
+
+def read_rpm_header(reader: RangeReader) -> dict:
+    if reader.read(0, 4) != b"\xed\xab\xee\xdb":
+        raise ValueError(f"Not an rpm package: {reader.source}")
+
+    offset = 96
+    for is_signature in (True, False):
+        header = reader.read(offset, 16)
+        if header[:4] != b"\x8e\xad\xe8\x01":
+            raise ValueError(f"Bad rpm header in {reader.source}")
+        count, data_size = struct.unpack(">II", header[8:16])
+        index_offset = offset + 16
+        data_offset = index_offset + 16 * count
+        offset = data_offset + data_size
+        if is_signature:
+            offset += -offset % 8
+
+    fields = {}
+    index = reader.read(index_offset, 16 * count)
+    for entry in range(count):
+        tag, kind, position, _ = struct.unpack(
+            ">iiii", index[entry * 16 : entry * 16 + 16]
+        )
+        if tag in RPM_TAGS and kind in (6, 8, 9):
+            value = b""
+            while b"\0" not in value:
+                chunk = reader.read(data_offset + position + len(value), 256)
+                if not chunk:
+                    break
+                value += chunk
+            fields[RPM_TAGS[tag]] = value.split(b"\0", 1)[0].decode("UTF-8")
+    return fields
+
+
+def read_deb_control(reader: RangeReader) -> dict:
+    if reader.read(0, 8) != b"!<arch>\n":
+        raise ValueError(f"Not a deb package: {reader.source}")
+
+    offset = 8
+    while header := reader.read(offset, 60):
+        if len(header) < 60:
+            break
+        name = header[:16].decode().strip().rstrip("/")
+        size = int(header[48:58].decode().strip())
+        offset += 60
+        if name.startswith("control.tar"):
+            return parse_control(extract_control(name, reader.read(offset, size)))
+        offset += size + size % 2
+    raise ValueError(f"No control archive in {reader.source}")
+
+
+def extract_control(member_name: str, data: bytes) -> str:
+    if member_name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compressed control archive is not supported")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        for member in tar.getmembers():
+            if member.name in ("./control", "control"):
+                return tar.extractfile(member).read().decode("UTF-8")
+    raise ValueError("No control file in control archive")
+
+
+def parse_control(text: str) -> dict:
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith((" ", "\t")) and key:
+            fields[key] += "\n" + line
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+    return fields
+
+
+class Downloads:
+    def __init__(self) -> None:
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, file_path: str, sha256: str = None) -> RemoteInfo:
+        while True:
+            with self._lock:
+                flight = self._flights.get(file_path)
+                if flight is None:
+                    flight = self._flights[file_path] = ((url, sha256), Future())
+                    break
+            # Tools sharing pkg_dir write the same file, wait for the one under way
+            source, future = flight
+            try:
+                info = future.result()
+            except Exception:
+                if source == (url, sha256):
+                    raise
+                continue
+            if source == (url, sha256):
+                with self._lock:
+                    self.shared += 1
+                return self.reuse(info)
+
+        _, future = flight
+        try:
+            info = Download(url, file_path).run(sha256=sha256)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(info)
+        finally:
+            with self._lock:
+                del self._flights[file_path]
+        return info
+
+    async def fetch_async(
+        self,
+        client: "AsyncHttpClient",
+        url: str,
+        file_path: str,
+        sha256: str = None,
+    ) -> RemoteInfo:
+        while True:
+            flight = self._flights.get(file_path)
+            if flight is None:
+                future = asyncio.get_running_loop().create_future()
+                flight = self._flights[file_path] = ((url, sha256), future)
+                break
+            source, future = flight
+            try:
+                info = await asyncio.shield(future)
+            except Exception:
+                if source == (url, sha256):
+                    raise
+                continue
+            if source == (url, sha256):
+                self.shared += 1
+                return self.reuse(info)
+
+        _, future = flight
+        try:
+            info = await AsyncDownload(client, url, file_path).run(sha256=sha256)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(info)
+        finally:
+            del self._flights[file_path]
+        return info
+
+    @staticmethod
+    def reuse(info: RemoteInfo) -> RemoteInfo:
+        if info is None:
+            return None
+        info = copy.copy(info)
+        info.transferred = 0
+        return info
+
+
+downloads = Downloads()
+
+
+def download_path(url: str, dest_folder: str, file_name=None) -> str:
     if not os.path.exists(dest_folder):
-        os.makedirs(dest_folder)
+        os.makedirs(dest_folder, exist_ok=True)
 
     if not file_name:
         file_name = urllib.parse.unquote(url).split("/")[-1]
-    file_path = os.path.join(dest_folder, file_name)
+    return os.path.join(dest_folder, file_name)
 
-    r = requests.get(url, stream=True)
-    if r.ok:
-        with open(file_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                f.write(chunk)
-        return True
-    else:
-        print(f"Download failed: status code {r.status_code}\n{r.text}")
-        return False
+
+def download_file(
+    url: str, dest_folder: str, file_name=None, sha256: str = None
+) -> RemoteInfo:
+    file_path = download_path(url, dest_folder, file_name)
+    return downloads.fetch(url, file_path, sha256=sha256)
+
+
+def file_digests(file_path: str) -> dict:
+    hashes = {name: hashlib.new(name) for name in DIGESTS}
+    with open(file_path, "rb") as f:
+        while block := f.read(Download.CHUNK_SIZE):
+            for h in hashes.values():
+                h.update(block)
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+def is_checksum_file(name: str) -> bool:
+    return bool(
+        re.search(
+            r"(\.sha256(sum)?|sha256sums?(\.txt)?|checksums?(\.txt)?)$", name.lower()
+        )
+    )
+
+
+def checksum_asset_url(pkg_name: str, checksums: list) -> str:
+    for item in checksums:
+        if item["name"] in [f"{pkg_name}.sha256", f"{pkg_name}.sha256sum"]:
+            return item["browser_download_url"]
+    for item in checksums:
+        if not item["name"].lower().endswith((".sha256", ".sha256sum")):
+            return item["browser_download_url"]
+    return None
+
+
+def parse_checksums(text: str, file_name: str) -> str:
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines:
+        if m := re.match(r"^([0-9a-fA-F]{64})(\s+\*?(.+))?$", line):
+            if m.groups()[2] is None and len(lines) == 1:
+                return m.groups()[0].lower()
+            if m.groups()[2] and os.path.basename(m.groups()[2]) == file_name:
+                return m.groups()[0].lower()
+    return None
 
 
 def print_info(tool: Tool, verbose: int) -> None:
@@ -622,7 +2684,7 @@ def print_info(tool: Tool, verbose: int) -> None:
     print("")
 
     print(indent * 2, "Tool definition (rendered):")
-    tm = Template(
+    tm = templates.env.from_string(
         yaml.dump(
             tool.tool_def,
             default_flow_style=False,
@@ -637,7 +2699,7 @@ def print_info(tool: Tool, verbose: int) -> None:
 
     if verbose >= 3:
         print(indent * 2, "Tool object attributes (rendered):")
-        tm = Template(
+        tm = templates.env.from_string(
             yaml.safe_dump(
                 json.loads(json.dumps(vars(tool))),
                 default_flow_style=False,
@@ -653,51 +2715,927 @@ def print_info(tool: Tool, verbose: int) -> None:
     print("")
 
 
-def update_repo(repo_path: str) -> None:
-    rpm_cmd = subprocess.run(
-        shlex.split(f"createrepo '{os.path.expandvars(repo_path)}'"),
-        capture_output=True,
-        encoding="UTF-8",
+REPO_STATE = ".update-tools-repo.json"
+APT_CACHE = ".update-tools-apt.json"
+APT_INDEXES = ("Packages", "Packages.gz", "Packages.xz")
+
+
+def repo_files(repo_path: str) -> dict:
+    files = {"rpm": [], "deb": []}
+    for root, dirs, names in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if d != "repodata" and not d.startswith(".")]
+        for name in names:
+            kind = name.rsplit(".", 1)[-1]
+            if kind in files and not name.startswith("."):
+                files[kind].append(os.path.relpath(os.path.join(root, name), repo_path))
+    return {kind: sorted(paths) for kind, paths in files.items()}
+
+
+def repo_fingerprints(repo_path: str) -> dict:
+    fingerprints = {}
+    for kind, paths in repo_files(repo_path).items():
+        if paths:
+            entries = []
+            for path in paths:
+                stat = os.stat(os.path.join(repo_path, path))
+                entries.append(f"{path}\0{stat.st_size}\0{stat.st_mtime}")
+            fingerprints[kind] = hashlib.sha256("\n".join(entries).encode()).hexdigest()
+    return fingerprints
+
+
+# Field order of dpkg-scanpackages, fields it does not know follow sorted by name
+DEB_INDEX_FIELDS = (
+    "Package",
+    "Package-Type",
+    "Source",
+    "Version",
+    "Kernel-Version",
+    "Built-For-Profiles",
+    "Auto-Built-Package",
+    "Architecture",
+    "Subarchitecture",
+    "Installer-Menu-Item",
+    "Essential",
+    "Origin",
+    "Bugs",
+    "Maintainer",
+    "Installed-Size",
+    "Pre-Depends",
+    "Depends",
+    "Recommends",
+    "Suggests",
+    "Enhances",
+    "Conflicts",
+    "Breaks",
+    "Replaces",
+    "Provides",
+    "Built-Using",
+    "Static-Built-Using",
+    "Filename",
+    "Size",
+    "MD5sum",
+    "SHA1",
+    "SHA256",
+    "Section",
+    "Priority",
+    "Multi-Arch",
+    "Homepage",
+    "Description",
+    "Tag",
+    "Task",
+)
+
+
+def deb_stanza(control: dict, file_fields: dict) -> str:
+    fields = {**control, **file_fields}
+    order = {key.lower(): index for index, key in enumerate(DEB_INDEX_FIELDS)}
+    keys = sorted(fields, key=lambda key: (order.get(key.lower(), len(order)), key))
+    lines = [
+        f"{key}:{fields[key]}"
+        if fields[key].startswith("\n")
+        else f"{key}: {fields[key]}"
+        for key in keys
+    ]
+    return "\n".join(lines) + "\n\n"
+
+
+def update_apt_index(repo_path: str) -> None:
+    cache_path = os.path.join(repo_path, APT_CACHE)
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    manifest = Manifest.for_dir(repo_path)
+
+    outputs = []
+    for name in APT_INDEXES:
+        fd, tmp_path = tempfile.mkstemp(dir=repo_path, prefix=f".{name}.")
+        raw = os.fdopen(fd, "wb")
+        if name.endswith(".gz"):
+            stream = gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+        elif name.endswith(".xz"):
+            stream = lzma.LZMAFile(raw, "wb")
+        else:
+            stream = raw
+        outputs.append((name, tmp_path, raw, stream))
+
+    entries = {}
+    try:
+        for path in repo_files(repo_path)["deb"]:
+            full_path = os.path.join(repo_path, path)
+            stat = os.stat(full_path)
+            entry = cache.get(path)
+            if not entry or (entry["size"], entry["mtime"]) != (
+                stat.st_size,
+                stat.st_mtime,
+            ):
+                record = manifest.get(path) or {}
+                digests = {name: record[name] for name in DIGESTS if name in record}
+                if len(digests) != len(DIGESTS):
+                    digests = file_digests(full_path)
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "control": read_deb_control(RangeReader(full_path)),
+                    "digests": digests,
+                }
+            entries[path] = entry
+            stanza = deb_stanza(
+                entry["control"],
+                {
+                    "Filename": f"./{path}",
+                    "Size": str(entry["size"]),
+                    "MD5sum": entry["digests"]["md5"],
+                    "SHA1": entry["digests"]["sha1"],
+                    "SHA256": entry["digests"]["sha256"],
+                },
+            ).encode("UTF-8")
+            for _, _, _, stream in outputs:
+                stream.write(stanza)
+        for _, _, raw, stream in outputs:
+            stream.close()
+            raw.close()
+        for name, tmp_path, _, _ in outputs:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(repo_path, name))
+    except BaseException:
+        for _, tmp_path, raw, _ in outputs:
+            raw.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    write_atomic(cache_path, json.dumps(entries, indent=2, sort_keys=True).encode())
+
+    release = [
+        f"Date: {email.utils.formatdate(usegmt=True)}",
+    ]
+    indexes = {
+        name: file_digests(os.path.join(repo_path, name)) for name in APT_INDEXES
+    }
+    for field, digest in (("MD5Sum", "md5"), ("SHA1", "sha1"), ("SHA256", "sha256")):
+        release.append(f"{field}:")
+        for name, digests in indexes.items():
+            size = os.path.getsize(os.path.join(repo_path, name))
+            release.append(f" {digests[digest]} {size:>16} {name}")
+    write_atomic(
+        os.path.join(repo_path, "Release"), ("\n".join(release) + "\n").encode()
     )
-    if rpm_cmd.returncode:
-        raise RuntimeError(f"Failed to update RPM repo in {repo_path}")
 
-    deb_cmd = subprocess.run(
-        shlex.split("dpkg-scanpackages -m ."),
-        cwd=os.path.expandvars(repo_path),
-        capture_output=True,
+
+def print_profile(tools: list, trace_file: str) -> None:
+    indent = " " * 4
+    print("")
+    print("Profile:")
+    print(
+        indent,
+        f"{'category':<10} {'name':<40} {'count':>6} {'total s':>9} {'max s':>8}",
     )
-    if deb_cmd.returncode:
-        raise RuntimeError(f"Failed to generate Packages from {repo_path}")
-    else:
+    for (category, name), (count, total, longest) in profiler.summary()[:40]:
+        print(
+            indent,
+            f"{category:<10} {name[:40]:<40} {count:>6} "
+            f"{total / 1e6:>9.3f} {longest / 1e6:>8.3f}",
+        )
+
+    print("")
+    print("Slowest tools:")
+    stages = ("resolve", "download", "install")
+    for tool in sorted(
+        tools, key=lambda t: sum(t.timings.get(s, 0) for s in stages), reverse=True
+    )[:10]:
+        phases = ", ".join(
+            f"{name} {value:.3f}"
+            for name, value in tool.timings.items()
+            if name not in stages
+        )
+        total = sum(tool.timings.get(s, 0) for s in stages)
+        print(indent, f"{tool.name:<30} {total:>8.3f}s  {phases}")
+
+    if trace_file:
+        profiler.write_trace(trace_file)
+        print("")
+        print(f"Trace written to {trace_file}")
+
+
+def metric_labels(**labels) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def write_metrics(path: str, tools: list, errors: int, started: float) -> None:
+    metrics = {}
+
+    def add(name: str, description: str, value: float, **labels) -> None:
+        metrics.setdefault(name, (description, []))[1].append((labels, value))
+
+    cache = http_client.cache
+    add("update_tools_last_run_timestamp_seconds", "End of the last run.", time.time())
+    add(
+        "update_tools_run_duration_seconds",
+        "Duration of the last run.",
+        time.monotonic() - started,
+    )
+    add("update_tools_tools", "Tools processed in the last run.", len(tools))
+    add(
+        "update_tools_outdated_tools",
+        "Tools with a newer remote version.",
+        sum(version_mismatch(tool.v_remote, tool.v_local) for tool in tools),
+    )
+    add("update_tools_errors", "Errors reported by the last run.", errors)
+    add(
+        "update_tools_downloaded_bytes",
+        "Bytes downloaded by the last run.",
+        sum(tool.dl_bytes for tool in tools),
+    )
+    add("update_tools_http_cache_hits", "HTTP cache hits.", cache.hits)
+    add("update_tools_http_cache_misses", "HTTP cache misses.", cache.misses)
+    if cache.hits + cache.misses:
+        add(
+            "update_tools_http_cache_hit_ratio",
+            "Share of cached HTTP responses that were still valid.",
+            cache.hits / (cache.hits + cache.misses),
+        )
+    add(
+        "update_tools_state_reused_tools",
+        "Tools answered from the state store.",
+        sum(tool.restored for tool in tools),
+    )
+    for host, limit in sorted(http_client.limiter.limits.items()):
+        add(
+            "update_tools_github_rate_limit_remaining",
+            "Remaining GitHub API requests.",
+            limit["remaining"],
+            host=host,
+        )
+        add(
+            "update_tools_github_rate_limit_reset_timestamp_seconds",
+            "When the GitHub API rate limit resets.",
+            limit["reset"],
+            host=host,
+        )
+    for tool in sorted(tools, key=lambda t: t.name):
+        add(
+            "update_tools_tool_outdated",
+            "Whether a newer remote version of the tool exists.",
+            int(version_mismatch(tool.v_remote, tool.v_local)),
+            tool=tool.name,
+        )
+        add(
+            "update_tools_tool_errors",
+            "Errors reported for the tool.",
+            len(tool._errors),
+            tool=tool.name,
+        )
+        add(
+            "update_tools_tool_downloaded_bytes",
+            "Bytes downloaded for the tool.",
+            tool.dl_bytes,
+            tool=tool.name,
+        )
+        for stage in ("resolve", "download", "install"):
+            if stage in tool.timings:
+                add(
+                    "update_tools_tool_duration_seconds",
+                    "Time spent on a stage of the tool.",
+                    round(tool.timings[stage], 6),
+                    tool=tool.name,
+                    stage=stage,
+                )
+
+    lines = []
+    for name, (description, samples) in metrics.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{metric_labels(**labels)} {value}")
+    write_atomic(path, ("\n".join(lines) + "\n").encode())
+
+
+def update_repo(repo_path: str) -> None:
+    repo_path = os.path.expandvars(repo_path)
+    state_path = os.path.join(repo_path, REPO_STATE)
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    fingerprints = repo_fingerprints(repo_path)
+
+    repodata = os.path.join(repo_path, "repodata")
+    if "rpm" in fingerprints and (
+        state.get("rpm") != fingerprints["rpm"] or not os.path.isdir(repodata)
+    ):
+        rpm_args = ["createrepo", repo_path]
+        if os.path.isdir(repodata):
+            rpm_args.insert(1, "--update")
+        rpm_cmd = run_command(rpm_args)
+        if rpm_cmd.returncode:
+            raise RuntimeError(f"Failed to update RPM repo in {repo_path}")
+        state["rpm"] = fingerprints["rpm"]
+        write_atomic(state_path, json.dumps(state, indent=2).encode())
+
+    if "deb" in fingerprints and (
+        state.get("deb") != fingerprints["deb"]
+        or not all(
+            os.path.isfile(os.path.join(repo_path, name))
+            for name in APT_INDEXES + ("Release",)
+        )
+    ):
         try:
-            with gzip.open(os.path.join(repo_path, "Packages.gz"), "wb") as f:
-                f.write(deb_cmd.stdout)
-        except Exception as e:
-            raise e
+            update_apt_index(repo_path)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            raise RuntimeError(f"Failed to generate Packages from {repo_path}: {e}")
+        state["deb"] = fingerprints["deb"]
+        write_atomic(state_path, json.dumps(state, indent=2).encode())
 
 
-def process_tool(tool_def: dict, defaults: dict, args: argparse.Namespace) -> Tool:
-    tool = None
+def make_tool(tool_def: dict, defaults: dict) -> Tool:
     if tool_def.get("type") == "git":
-        tool = ToolGit(tool_def, defaults)
+        return ToolGit(tool_def, defaults)
     elif tool_def.get("type") == "direct":
-        tool = ToolDirect(tool_def, defaults)
+        return ToolDirect(tool_def, defaults)
     else:
-        tool = ToolCustom(tool_def, defaults)
-    tool.get_data()
+        return ToolCustom(tool_def, defaults)
+
+
+class PipelineStage:
+    def __init__(self, func, workers: int, outbox: queue.Queue, on_done=None):
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.inbox = queue.Queue(maxsize=2 * self.workers)
+        self.outbox = outbox
+        self.sentinels = 1
+        self.on_done = on_done
+        self._running = self.workers
+        self._lock = threading.Lock()
+
+    def start(self) -> list:
+        threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _work(self) -> None:
+        while (tool := self.inbox.get()) is not None:
+            try:
+                self.func(tool)
+            except Exception as e:
+                tool._errors.append(e)
+            self.outbox.put(tool)
+        with self._lock:
+            self._running -= 1
+            last = not self._running
+        if last:
+            for _ in range(self.sentinels):
+                self.outbox.put(None)
+            if self.on_done:
+                self.on_done()
+
+
+class Pipeline:
+    def __init__(self, args: argparse.Namespace, defaults: dict) -> None:
+        self.args = args
+        self.defaults = defaults
+        self.workers = defaults["workers"]
+        self.tools = []
+
+    def run(self, tool_defs: list, report, refresh) -> None:
+        args = self.args
+        self.tools = [make_tool(tool_def, defaults) for tool_def, defaults in tool_defs]
+        done = queue.Queue()
+        install = PipelineStage(self.install, self.workers["install"], done)
+        download = PipelineStage(
+            self.download,
+            self.workers["download"],
+            install.inbox,
+            on_done=lambda: refresh(self.tools),
+        )
+        resolve = PipelineStage(self.resolve, self.workers["resolve"], download.inbox)
+        resolve.sentinels = download.workers
+        download.sentinels = install.workers
+
+        threads = resolve.start() + download.start() + install.start()
+        feeder = threading.Thread(
+            target=self._feed, args=(resolve, self.tools), daemon=True
+        )
+        feeder.start()
+        while (tool := done.get()) is not None:
+            if args.check or not (args.download or args.update):
+                tool.check(verbose=args.verbose, skip=args.skip_current)
+            report(tool)
+        for thread in [feeder] + threads:
+            thread.join()
+
+    def _feed(self, stage: PipelineStage, tools: list) -> None:
+        for tool in tools:
+            stage.inbox.put(tool)
+        for _ in range(stage.workers):
+            stage.inbox.put(None)
+
+    def resolve(self, tool: Tool) -> None:
+        with profiler.span("resolve", "stage", tool):
+            if not state_store.restore(tool):
+                tool.get_data()
+                state_store.save(tool)
+
+    def download(self, tool: Tool) -> None:
+        args = self.args
+        if args.download and tool.resolved():
+            try:
+                with profiler.span("download", "stage", tool):
+                    tool.download(
+                        verbose=args.verbose, force=args.force, skip=args.skip_current
+                    )
+            finally:
+                if tool.dl_ok:
+                    state_store.forget(tool)
+
+    def install(self, tool: Tool) -> None:
+        args = self.args
+        if args.update and tool.resolved():
+            try:
+                with profiler.span("install", "stage", tool):
+                    tool.update(
+                        verbose=args.verbose, force=args.force, skip=args.skip_current
+                    )
+            finally:
+                if tool.updated:
+                    state_store.forget(tool)
 
-    if args.download:
-        tool.download(verbose=args.verbose, force=args.force, skip=args.skip_current)
-    if args.update:
-        tool.update(verbose=args.verbose, force=args.force, skip=args.skip_current)
-    if args.check or not (args.download or args.update):
-        tool.check(verbose=args.verbose, skip=args.skip_current)
 
-    return tool
+class AsyncResponse:
+    def __init__(self, status: int, headers, content: bytes, url: str) -> None:
+        self.status_code = status
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.url = url
+        self.encoding = None
+        self.ok = status < 400
+
+
+class AsyncHttpClient:
+    def __init__(self) -> None:
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError("--engine async requires the aiohttp package")
+        self._aiohttp = aiohttp
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        timeout = http_client.timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=0),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+        )
+        self._limits = {}
+        self._flights = {}
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    def _limit(self, url: str) -> asyncio.Semaphore:
+        host = urllib.parse.urlsplit(url).hostname
+        if host not in self._limits:
+            size = http_client.pools.get(host, http_client.pool_size)
+            self._limits[host] = asyncio.Semaphore(int(size))
+        return self._limits[host]
+
+    async def request(
+        self, method: str, url: str, read: bool = True, limit: int = None, **kwargs
+    ) -> AsyncResponse:
+        limiter = http_client.limiter
+        host = urllib.parse.urlsplit(url).hostname
+        for attempt in range(http_client.retries + 1):
+            await limiter.acquire_async(url)
+            try:
+                async with self._limit(url):
+                    with profiler.span(f"{method} {host}", "http", url=url):
+                        async with self.session.request(method, url, **kwargs) as r:
+                            content = await self._read(r, limit) if read else b""
+            except self.errors:
+                limiter.release(url)
+                if attempt == http_client.retries:
+                    raise
+            except BaseException:
+                limiter.release(url)
+                raise
+            else:
+                limited = limiter.release(url, r.status, r.headers)
+                if attempt == http_client.retries or not (
+                    limited or r.status in (500, 502, 503, 504)
+                ):
+                    return AsyncResponse(r.status, r.headers, content, str(r.url))
+                if limited:
+                    continue
+            await asyncio.sleep(http_client.backoff * 2**attempt)
+
+    @staticmethod
+    async def _read(r, limit: int = None) -> bytes:
+        if limit is None:
+            return await r.read()
+        content = b""
+        while len(content) < limit and (
+            chunk := await r.content.read(limit - len(content))
+        ):
+            content += chunk
+        return content
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, headers: dict = None):
+        limiter = http_client.limiter
+        host = urllib.parse.urlsplit(url).hostname
+        await limiter.acquire_async(url)
+        released = False
+        try:
+            async with self._limit(url):
+                with profiler.span(f"GET {host}", "http", url=url):
+                    async with self.session.get(url, headers=headers) as r:
+                        released = True
+                        limiter.release(url, r.status, r.headers)
+                        yield r
+        except BaseException:
+            if not released:
+                limiter.release(url)
+            raise
+
+    async def get_cached(self, url: str, headers: dict = None) -> AsyncResponse:
+        key = http_client.cache.key(url, headers or {})
+        if key in self._flights:
+            http_client.count_shared()
+            return await asyncio.shield(self._flights[key])
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            resp = await self._get_cached(url, headers)
+        except asyncio.CancelledError:
+            del self._flights[key]
+            flight.cancel()
+            raise
+        except Exception as e:
+            del self._flights[key]
+            flight.set_exception(e)
+            flight.exception()
+            raise
+        flight.set_result(resp)
+        return resp
+
+    async def _get_cached(self, url: str, headers: dict = None) -> AsyncResponse:
+        cache = http_client.cache
+        if not cache.enabled:
+            return await self.request("GET", url, headers=headers)
+
+        headers = dict(headers or {})
+        key = cache.key(url, headers)
+        entry = cache.conditional(key, headers)
+        return cache.settle(key, entry, await self.request("GET", url, headers=headers))
+
+    async def probe(self, url: str, record: dict = None) -> RemoteInfo:
+        headers = probe_headers(record)
+        r = await self.request("HEAD", url, headers=headers)
+        info = RemoteInfo(r.status_code, r.headers)
+        if info.not_modified or (r.ok and info.size is not None):
+            return info
+
+        headers["Range"] = "bytes=0-0"
+        r = await self.request("GET", url, headers=headers, read=False)
+        return RemoteInfo(r.status_code, r.headers)
+
+
+class AsyncEngine:
+    def __init__(self, args: argparse.Namespace, defaults: dict) -> None:
+        self.args = args
+        self.defaults = defaults
+        self.client = None
+        self._procs = None
+        self._stages = {}
+        self._installs = None
+        self._installed = {}
+        self._pending = 0
+        self._refresh = None
+
+    def run(self, tool_defs: list, report, refresh) -> None:
+        tools = [make_tool(tool_def, defaults) for tool_def, defaults in tool_defs]
+        asyncio.run(self._run(tools, report, refresh))
+
+    async def _run(self, tools: list, report, refresh) -> None:
+        self.client = AsyncHttpClient()
+        self._procs = asyncio.Semaphore(os.cpu_count() or 4)
+        self._installs = asyncio.Condition()
+        self._stages = {
+            name: asyncio.Semaphore(max(1, int(count)))
+            for name, count in self.defaults["workers"].items()
+        }
+        self._pending = len(tools)
+        if not tools:
+            refresh(tools)
+        tasks = [
+            asyncio.ensure_future(self.process(tool, tools, refresh)) for tool in tools
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                report(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.client.close()
+        if self._refresh:
+            await self._refresh
+
+    async def process(self, tool: Tool, tools: list, refresh) -> Tool:
+        args = self.args
+        async with self._stages["resolve"]:
+            with profiler.span("resolve", "stage", tool):
+                if not state_store.restore(tool):
+                    await self.get_data(tool)
+                    state_store.save(tool)
+
+        try:
+            if args.download and tool.resolved():
+                async with self._stages["download"]:
+                    with profiler.span("download", "stage", tool):
+                        await self.download(tool)
+        except Exception as e:
+            tool._errors.append(e)
+        self._pending -= 1
+        if not self._pending:
+            self._refresh = asyncio.ensure_future(asyncio.to_thread(refresh, tools))
+
+        try:
+            if args.update and tool.resolved():
+                async with self._stages["install"]:
+                    with profiler.span("install", "stage", tool):
+                        await self.update(tool)
+        except Exception as e:
+            tool._errors.append(e)
+        finally:
+            if tool.dl_ok or tool.updated:
+                state_store.forget(tool)
+        if args.check or not (args.download or args.update):
+            tool.check(verbose=args.verbose, skip=args.skip_current)
+
+        return tool
+
+    async def get_data(self, tool: Tool) -> None:
+        try:
+            await self.run_steps(tool.lookup())
+        except Exception as e:
+            tool._errors.append(e)
+
+    async def run_steps(self, steps):
+        send, value = steps.send, None
+        while True:
+            try:
+                step = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, value = steps.send, await step.run_async(self)
+            except Exception as e:
+                send, value = steps.throw, e
+
+    async def download(self, tool: Tool) -> None:
+        args = self.args
+        checksums = None
+        if tool.checksum_url and not tool.pkg_digest:
+            r = await self.client.get_cached(tool.checksum_url)
+            checksums = r.content.decode(errors="replace") if r.ok else ""
+        sha256 = tool._remote_digest(checksums)
+
+        dl, record = tool._check_local(args.verbose, args.force, sha256)
+        if dl is None:
+            with profiler.span("probe", "phase", tool):
+                info = await self.client.probe(tool.pkg_url, record)
+            dl = tool._check_remote(args.verbose, info, record)
+
+        info = None
+        if dl:
+            tool._download_started(args.verbose)
+            try:
+                with profiler.span("transfer", "phase", tool):
+                    step = FetchFile(tool.pkg_url, tool.pkg_dir, tool.pkg_name, sha256)
+                    info = await step.run_async(self)
+            except ValueError as e:
+                tool._errors.append(e)
+        tool._download_finished(args.verbose, dl, info, sha256, args.skip_current)
+
+    async def update(self, tool: Tool) -> None:
+        args = self.args
+        if tool._update_needed(args.verbose, args.force, args.skip_current):
+            steps = tool._install_steps()
+            resources = tool._install_resources(args.verbose, steps)
+            async with self._installs:
+                await self._installs.wait_for(
+                    lambda: install_locks.try_acquire(resources)
+                )
+            try:
+                for count, cmd in enumerate(steps, start=1):
+                    tool._step_started(args.verbose, count, cmd)
+                    started = time.monotonic()
+                    with profiler.span(f"step {count}", "phase", tool, cmd=cmd):
+                        proc = await asyncio.create_subprocess_exec(
+                            *shlex.split(cmd),
+                            stdout=asyncio.subprocess.DEVNULL,
+                            stderr=asyncio.subprocess.DEVNULL,
+                        )
+                        returncode = await proc.wait()
+                    tool._step_finished(
+                        args.verbose, count, returncode, time.monotonic() - started
+                    )
+            finally:
+                install_locks.release(resources)
+                async with self._installs:
+                    self._installs.notify_all()
+            tool.updated = True
+
+    async def command(self, args: list) -> subprocess.CompletedProcess:
+        async with self._procs:
+            with profiler.span(os.path.basename(args[0]), "subprocess", args=args):
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                stdout, stderr = await proc.communicate()
+        return subprocess.CompletedProcess(
+            args,
+            proc.returncode,
+            stdout.decode("UTF-8", errors="replace"),
+            stderr.decode("UTF-8", errors="replace"),
+        )
+
+    async def installed(self, kind: str) -> dict:
+        if kind not in self._installed:
+            self._installed[kind] = asyncio.ensure_future(self._load_installed(kind))
+        return await asyncio.shield(self._installed[kind])
+
+    async def _load_installed(self, kind: str) -> dict:
+        args = installed_packages.command(kind)
+        out = (await self.command(args)).stdout if args else ""
+        return installed_packages.parse(kind, out)
+
+    async def probe(self, args: list, matcher: VersionMatcher, timeout: float) -> str:
+        async with self._procs:
+            with profiler.span(os.path.basename(args[0]), "subprocess", args=args):
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+                try:
+                    await asyncio.wait_for(self._read_probe(proc, matcher), timeout)
+                except asyncio.TimeoutError:
+                    raise probe_timeout_error(args, timeout)
+                finally:
+                    kill_probe(proc.pid)
+                    await proc.wait()
+        return matcher.output
+
+    async def _read_probe(self, proc, matcher: VersionMatcher) -> None:
+        while line := await proc.stdout.readline():
+            if matcher.feed(line.decode("UTF-8", errors="replace")):
+                return
+
+
+DEFAULTS = {
+    "bin_dir": "$HOME/bin",
+    "opt_dir": "/opt",
+    "tmp_dir": "/tmp",
+    "pkg_dir": "$HOME/Repos/packages",
+    "ver": {
+        "type": "cmd",
+        "name": "{{ tool.name }} --version",
+        "regex": None,
+        "match": None,
+        "timeout": 10,
+    },
+    "git": {
+        "look_up": "releases",
+        "tag": "latest",
+        "custom": "no",
+        "token_env": "GITHUB_TOKEN",
+        "api_url": "https://api.github.com",
+        "resolver": "rest",
+    },
+    "http": {
+        "timeout": 30,
+        "retries": 3,
+        "backoff": 0.5,
+        "pool_size": 32,
+        "pools": {},
+        "segments": 4,
+        "segment_size": 8,
+        "cache_max_age": 30,
+        "cache_max_size": 100,
+        "rate_limit_low": 100,
+        "rate_limit_wait": 60,
+    },
+    "workers": {
+        "resolve": 16,
+        "download": 4,
+        "install": 4,
+    },
+}
+
+
+def config_index_path(config_path: str) -> str:
+    directory, name = os.path.split(os.path.realpath(config_path))
+    return os.path.join(directory, f".{name}.index.json")
+
+
+def read_config_index(config_path: str) -> list:
+    try:
+        stat = os.stat(config_path)
+        with open(config_index_path(config_path), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (index.get("size"), index.get("mtime")) == (stat.st_size, stat.st_mtime):
+        return index.get("names")
+    return None
+
+
+def write_config_index(config_path: str, tools: list) -> None:
+    try:
+        stat = os.stat(config_path)
+        index = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "names": [tool["name"] for tool in tools],
+        }
+        write_atomic(config_index_path(config_path), json.dumps(index).encode())
+    except (OSError, KeyError, TypeError):
+        pass
+
+
+def load_config(stream, cache_dir: str) -> tuple:
+    raw = stream.read()
+    digest = hashlib.sha256(
+        raw.encode() + json.dumps(DEFAULTS, sort_keys=True).encode()
+    ).hexdigest()
+    name = hashlib.sha256(os.path.realpath(stream.name).encode()).hexdigest()
+    plan_path = os.path.join(cache_dir, "plans", f"{name}.json")
+    try:
+        with open(plan_path, "r") as f:
+            plan = json.load(f)
+        if plan["digest"] == digest:
+            if read_config_index(stream.name) is None:
+                write_config_index(stream.name, plan["tools"])
+            return plan["defaults"], plan["tools"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    data_loaded = yaml.load(raw, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    defaults = data_loaded.get("defaults", {})
+
+    for key in DEFAULTS.keys():
+        if type(DEFAULTS[key]) is not dict:
+            try:
+                defaults[key] = defaults[key]
+            except KeyError:
+                defaults[key] = DEFAULTS[key]
+        else:
+            defaults.setdefault(key, {})
+            for subkey in DEFAULTS[key].keys():
+                try:
+                    defaults[key][subkey] = defaults[key][subkey]
+                except KeyError:
+                    defaults[key][subkey] = DEFAULTS[key][subkey]
+
+    # Round-trip through JSON so a run sees the same types with or without the
+    # cached plan (e.g. YAML dates become strings either way)
+    plan = json.dumps(
+        {"digest": digest, "defaults": defaults, "tools": data_loaded.get("tools", [])},
+        default=str,
+    )
+    plan_data = json.loads(plan)
+    defaults, tools = plan_data["defaults"], plan_data["tools"]
+    write_config_index(stream.name, tools)
+    try:
+        os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+        write_atomic(plan_path, plan.encode())
+    except OSError:
+        pass
+    return defaults, tools
 
 
 def main():
+    started = time.monotonic()
     try:
         script_file_name, _ = os.path.splitext(__file__)
 
@@ -706,9 +3644,10 @@ def main():
         parser.add_argument(
             "-g",
             "--config-file",
-            help="path to configuration file, defaults to <script dir>/<script name>.yaml",
+            help="path to configuration file, defaults to <script dir>/<script name>.yaml; "
+            "can be repeated to process several files sharing remote lookups",
             type=argparse.FileType("r"),
-            default=f"{script_file_name}.yaml",
+            action="append",
         )
         parser.add_argument(
             "name", help="tool name", type=str, default="all", nargs="*"
@@ -737,112 +3676,203 @@ def main():
         parser.add_argument(
             "-s", "--skip-current", action="store_true", help="do not show current"
         )
+        parser.add_argument(
+            "--cache-dir",
+            help="directory for cached data, defaults to ~/.cache/update-tools",
+            default=default_cache_dir(),
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="do not use cached HTTP responses and version probes",
+        )
+        parser.add_argument(
+            "--max-age",
+            help="reuse results of tools checked within this many seconds",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--engine",
+            help="how to run the tools concurrently, defaults to threads",
+            choices=["threads", "async"],
+            default="threads",
+        )
+        parser.add_argument(
+            "--profile",
+            help="print time spent per phase, HTTP request and command, "
+            "optionally writing a Chrome trace to FILE",
+            nargs="?",
+            const="",
+            metavar="FILE",
+        )
+        parser.add_argument(
+            "--metrics",
+            help="write Prometheus metrics of the run to FILE",
+            metavar="FILE",
+        )
         parser.add_argument("-v", "--verbose", action="count", default=0)
         args = parser.parse_args()
-        conf = args.config_file
+        profiler.enabled = args.profile is not None
+        confs = args.config_file
+        if not confs:
+            try:
+                confs = [argparse.FileType("r")(f"{script_file_name}.yaml")]
+            except argparse.ArgumentTypeError as e:
+                parser.error(f"argument -g/--config-file: {e}")
+        conf = ", ".join(item.name for item in confs)
         names = args.name
 
         if args.verbose >= 2:
             print(f"Running script: '{__file__}'")
-            print(f"Configuration file: '{conf.name}'")
+            for item in confs:
+                print(f"Configuration file: '{item.name}'")
             print("")
 
-        with conf as stream:
-            data_loaded = yaml.safe_load(stream)
-
-        defaults_dict = {
-            "bin_dir": "$HOME/bin",
-            "opt_dir": "/opt",
-            "tmp_dir": "/tmp",
-            "pkg_dir": "$HOME/Repos/packages",
-            "ver": {
-                "type": "cmd",
-                "name": "{{ tool.name }} --version",
-                "regex": None,
-            },
-            "git": {
-                "look_up": "releases",
-                "tag": "latest",
-                "custom": "no",
-                "token_env": "GITHUB_TOKEN",
-            },
-        }
-        defaults = data_loaded.get("defaults", {})
-
-        for key in defaults_dict.keys():
-            if type(defaults_dict[key]) is not dict:
-                try:
-                    defaults[key] = defaults[key]
-                except KeyError:
-                    defaults[key] = defaults_dict[key]
-            else:
-                for subkey in defaults_dict[key].keys():
-                    try:
-                        defaults[key][subkey] = defaults[key][subkey]
-                    except KeyError:
-                        defaults[key][subkey] = defaults_dict[key][subkey]
+        tool_names = []
+        for item in confs:
+            if (index := read_config_index(item.name)) is None:
+                tool_names = None
+                break
+            tool_names += index
+        if args.list and tool_names is not None:
+            print("Supported tools:")
+            for name in sorted(set(tool_names)):
+                print(f"    {name}")
+            sys.exit()
+        if names and "all" not in names and tool_names is not None:
+            if not set(names) & set(tool_names):
+                print("Tool(s) not found!")
+                sys.exit()
+
+        # HTTP, workers and resolver settings of a run come from the first file
+        defaults = None
+        tools = []
+        for item in confs:
+            with item as stream, profiler.span("load_config", "main"):
+                config_defaults, config_tools = load_config(stream, args.cache_dir)
+            defaults = defaults or config_defaults
+            tools += [(tool_def, config_defaults) for tool_def in config_tools]
 
-        if args.verbose >= 2:
-            print("Defaults:")
-            for line in yaml.dump(
-                defaults,
-                default_flow_style=False,
-                sort_keys=False,
-                indent=4,
-                width=1000,
-            ).split("\n"):
-                print("    ", line)
-            print("")
+            if args.verbose >= 2:
+                print(f"Defaults ({item.name}):" if len(confs) > 1 else "Defaults:")
+                for line in yaml.dump(
+                    config_defaults,
+                    default_flow_style=False,
+                    sort_keys=False,
+                    indent=4,
+                    width=1000,
+                ).split("\n"):
+                    print("    ", line)
+                print("")
 
-        tools = data_loaded.get("tools", [])
+        http_client.configure(defaults["http"])
+        http_client.cache.configure(args.cache_dir, not args.no_cache, defaults["http"])
+        state_store.configure(args.cache_dir, args.max_age)
+        probe_cache.configure(args.cache_dir, not args.no_cache)
 
         if args.list:
             print("Supported tools:")
-            for tool in sorted(tools, key=lambda item: item["name"]):
-                print(f"    {tool['name']}")
+            for name in sorted({tool_def["name"] for tool_def, _ in tools}):
+                print(f"    {name}")
             sys.exit()
 
         if names and "all" not in names:
-            tools = [tool for tool in tools.copy() if tool["name"] in names]
+            tools = [tool for tool in tools if tool[0]["name"] in names]
         if not tools:
             print("Tool(s) not found!")
         else:
             print("Processing tools...")
 
+        if defaults["git"]["resolver"] == "graphql":
+            with profiler.span("prefetch", "main"):
+                github_resolver.prefetch(
+                    [
+                        ToolGit(tool_def, tool_defaults)
+                        for tool_def, tool_defaults in tools
+                        if tool_def.get("type") == "git"
+                        and state_store.fresh(tool_def, tool_defaults) is None
+                    ],
+                    defaults["git"]["token_env"],
+                )
+
         if args.verbose >= 2:
             print("Tools to process:")
-            for tool in sorted(tools, key=lambda item: item["name"]):
-                print(f"    {tool['name']}")
+            for tool_def, _ in sorted(tools, key=lambda item: item[0]["name"]):
+                print(f"    {tool_def['name']}")
             print("")
 
-        tools_dld = False
+        tools_restored = []
+        tools_done = []
         errors_list = []
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(
-                    process_tool, tool_def=tool_def, defaults=defaults, args=args
-                )
-                for tool_def in sorted(tools, key=lambda item: item["name"])
-            ]
 
-            for future in as_completed(futures):
-                tool = future.result()
-                for error in tool._errors:
-                    errors_list.append((tool.name, error))
-                if (tool.is_rpm or tool.is_deb) and tool.dl_ok:
-                    tools_dld = True
-                for msg in tool._outputs:
-                    print(msg)
-
-        if tools_dld:
-            if args.verbose >= 2:
-                print("")
-                print(f"Updating repo: {os.path.expandvars(defaults['pkg_dir'])}")
-                print("")
+        def report(tool: Tool) -> None:
+            tools_done.append(tool)
+            for error in tool._errors:
+                errors_list.append((tool.name, error))
+            if tool.restored:
+                tools_restored.append(tool.name)
+            for msg in tool._outputs:
+                print(msg)
+
+        def refresh(processed: list) -> None:
+            repo_paths = {
+                os.path.expandvars(tool.defaults["pkg_dir"])
+                for tool in processed
+                if (tool.is_rpm or tool.is_deb) and tool.dl_ok
+            }
+            for repo_path in sorted(repo_paths):
+                if args.verbose >= 2:
+                    print("")
+                    print(f"Updating repo: {repo_path}")
+                    print("")
+                try:
+                    with profiler.span("update_repo", "main"):
+                        update_repo(repo_path)
+                except Exception as e:
+                    errors_list.append(("repo_update", e))
+
+        checked = state_store.checked()
+        tools = sorted(
+            tools,
+            key=lambda item: (
+                checked.get(state_store.key(*item), 0),
+                item[0]["name"],
+            ),
+        )
+        if args.engine == "async":
+            AsyncEngine(args, defaults).run(tools, report, refresh)
+        else:
+            Pipeline(args, defaults).run(tools, report, refresh)
+
+        state_store.close()
+        probe_cache.save()
+        http_client.cache.evict()
+        if args.verbose >= 1 and http_client.cache.enabled:
+            print("")
+            print(
+                f"HTTP cache: {http_client.cache.hits} hits, "
+                f"{http_client.cache.misses} misses"
+            )
+        if args.verbose >= 1 and http_client.shared:
+            print(f"HTTP responses shared: {http_client.shared}")
+        if args.verbose >= 1 and downloads.shared:
+            print(f"Downloads shared: {downloads.shared}")
+        if args.verbose >= 1 and probe_cache.path:
+            print(
+                f"Version probes: {probe_cache.hits} cached, {probe_cache.misses} run"
+            )
+        if args.verbose >= 1 and args.max_age > 0:
+            print(f"State store: {len(tools_restored)} tools reused")
+
+        if profiler.enabled:
+            print_profile(tools_done, args.profile)
+
+        if args.metrics:
             try:
-                update_repo(os.path.expandvars(defaults["pkg_dir"]))
-            except Exception as e:
-                errors_list.append(("repo_update", e))
+                write_metrics(args.metrics, tools_done, len(errors_list), started)
+            except OSError as e:
+                errors_list.append(("metrics", e))
 
         if errors_list:
             print("")
@@ -850,8 +3880,9 @@ def main():
             for tool, error in errors_list:
                 print(f"    Tool '{tool}' - {error}")
 
-    except SystemExit:
-        pass
+    except SystemExit as e:
+        if e.code:
+            raise
     except KeyError as e:
         print(f"Missing section {e} in configuration file: {conf}")
     except Exception as e: